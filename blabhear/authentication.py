@@ -1,15 +1,23 @@
+import hashlib
 import logging
 import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
 from urllib.parse import parse_qs
 
 import firebase_admin
 import phonenumbers
+from asgiref.sync import async_to_sync
 from channels.auth import AuthMiddlewareStack
 from channels.db import database_sync_to_async
+from django.conf import settings
 from firebase_admin import auth, credentials
 from phonenumbers.phonenumberutil import region_code_for_number
 from rest_framework import authentication
 
+from blabhear.contacts import notify_contact_owners
 from blabhear.exceptions import (
     InvalidFirebaseAuthToken,
     FirebaseAuthError,
@@ -38,11 +46,54 @@ cred = credentials.Certificate(
 default_app = firebase_admin.initialize_app(cred)
 
 
+class IdTokenCache:
+    def __init__(self):
+        self.claims = OrderedDict()
+        self.verifying = {}
+        self.lock = threading.Lock()
+
+    def verify(self, token):
+        key = hashlib.sha256(token.encode()).hexdigest()
+        with self.lock:
+            if key in self.claims:
+                decoded_token = self.claims[key]
+                if decoded_token["exp"] > time.time():
+                    self.claims.move_to_end(key)
+                    return decoded_token
+                del self.claims[key]
+            verification = self.verifying.get(key)
+            if verification is None:
+                verification = self.verifying[key] = Future()
+                verifying = True
+            else:
+                verifying = False
+        if not verifying:
+            return verification.result()
+        try:
+            decoded_token = auth.verify_id_token(token)
+        except Exception as exc:
+            verification.set_exception(exc)
+            raise
+        else:
+            verification.set_result(decoded_token)
+            with self.lock:
+                self.claims[key] = decoded_token
+                while len(self.claims) > settings.ID_TOKEN_CACHE_SIZE:
+                    self.claims.popitem(last=False)
+            return decoded_token
+        finally:
+            with self.lock:
+                del self.verifying[key]
+
+
+id_token_cache = IdTokenCache()
+
+
 @database_sync_to_async
 def get_user(query_string):
     token = query_string["token"][0]
     try:
-        decoded_token = auth.verify_id_token(token)
+        decoded_token = id_token_cache.verify(token)
     except auth.RevokedIdTokenError as exc:
         raise InvalidFirebaseAuthToken(str(exc))
     except auth.UserDisabledError as exc:
@@ -55,19 +106,27 @@ def get_user(query_string):
     except Exception:
         raise FirebaseAuthError("Missing uid.")
     phone_number = decoded_token.get("phone_number")
-    user, created = User.objects.update_or_create(
-        phone_number=phone_number,
-        defaults={
-            "username": uid,
-            "alpha2_country_code": region_code_for_number(
-                phonenumbers.parse(phone_number)
-            ),
-        },
-    )
-    if created:
-        user.display_name = phone_number
-        user.save()
-    return user
+    created = False
+    try:
+        user = User.objects.get(phone_number=phone_number)
+    except User.DoesNotExist:
+        user, created = User.objects.get_or_create(
+            phone_number=phone_number,
+            defaults={
+                "username": uid,
+                "alpha2_country_code": region_code_for_number(
+                    phonenumbers.parse(phone_number)
+                ),
+                "display_name": phone_number,
+            },
+        )
+    if user.username != uid or not user.alpha2_country_code:
+        user.username = uid
+        user.alpha2_country_code = region_code_for_number(
+            phonenumbers.parse(phone_number)
+        )
+        user.save(update_fields=["username", "alpha2_country_code"])
+    return user, created
 
 
 class FirebaseAuthentication(authentication.BaseAuthentication):
@@ -77,7 +136,7 @@ class FirebaseAuthentication(authentication.BaseAuthentication):
             raise NoAuthToken()
         token = auth_header.split(" ").pop()
         try:
-            decoded_token = auth.verify_id_token(token)
+            decoded_token = id_token_cache.verify(token)
         except auth.RevokedIdTokenError as exc:
             raise InvalidAuthToken(str(exc))
         except auth.UserDisabledError as exc:
@@ -100,6 +159,8 @@ class FirebaseAuthentication(authentication.BaseAuthentication):
                 "display_name": phone_number,
             },
         )
+        if created:
+            async_to_sync(notify_contact_owners)(user)
         return user, None
 
 
@@ -108,7 +169,11 @@ class TokenAuthMiddleware:
         self.app = app
 
     async def __call__(self, scope, receive, send):
-        scope["user"] = await get_user(parse_qs(scope["query_string"].decode()))
+        scope["user"], created = await get_user(
+            parse_qs(scope["query_string"].decode())
+        )
+        if created:
+            await notify_contact_owners(scope["user"])
         return await self.app(scope, receive, send)
 
 
@@ -1,16 +1,44 @@
 import asyncio
+import datetime
 import logging
+import time
 import uuid
+from urllib.parse import parse_qs
 
-import phonenumbers
 from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
-from django.contrib.postgres.aggregates import ArrayAgg
-from django.db.models import Case, When, BooleanField
-from firebase_admin import messaging
-from phonenumbers.phonenumberutil import NumberParseException
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import (
+    Case,
+    When,
+    BooleanField,
+    Count,
+    Exists,
+    OuterRef,
+    F,
+    PositiveIntegerField,
+    Q,
+)
+from django.utils import timezone
 
+from blabhear.contacts import (
+    EMPTY_CONTACTS_DIGEST,
+    normalize_phone_contacts_in_chunks,
+    update_contacts_digest,
+)
+from blabhear.events import (
+    get_current_seq,
+    parse_seq,
+    replay_events,
+    room_stream,
+    send_room_event,
+    send_user_event,
+    user_stream,
+)
 from blabhear.exceptions import UserNotAllowedError
+from blabhear.inbox import update_unread_counts
+from blabhear.metrics import metrics
 from blabhear.models import (
     User,
     Room,
@@ -18,10 +46,17 @@ from blabhear.models import (
     UserRoomNotification,
     MessageNotification,
     Report,
+    Contact,
+    HiddenMessage,
 )
+from blabhear.presence import mark_absent, mark_present, get_present_usernames
+from blabhear.push import push_dispatcher
+from blabhear.rooms import get_member_key
 from blabhear.storage import (
-    generate_upload_signed_url_v4,
+    SIGNED_URL_REFRESH_IN,
     generate_download_signed_url_v4,
+    generate_download_signed_urls_v4,
+    upload_url_pool,
 )
 
 logger = logging.getLogger(__name__)
@@ -32,20 +67,43 @@ class UserConsumer(AsyncJsonWebsocketConsumer):
         super().__init__(args, kwargs)
         self.user = None
         self.username = None
+        self.pending_refresh = None
+        self.inbox_delta = False
+        self.inbox_versions = {}
+        self.user_seq = 0
+        self.replayed_seq = 0
 
     async def connect(self):
         self.username = str(self.scope["url_route"]["kwargs"]["user_id"])
         self.user = self.scope["user"]
+        query_string = parse_qs(self.scope["query_string"].decode())
+        self.inbox_delta = query_string.get("inbox") == ["delta"]
         if self.username == self.user.username:
             await self.channel_layer.group_add(self.username, self.channel_name)
             await self.accept()
-            await self.fetch_display_name()
-            await self.fetch_notifications()
+            missed_events = None
+            last_seq = parse_seq(query_string.get("last_seq", [None])[0])
+            if last_seq is not None:
+                self.user_seq = last_seq
+                missed_events = await replay_events(
+                    self.channel_layer, user_stream(self.username), self.user_seq
+                )
+            if missed_events is None:
+                self.user_seq = await get_current_seq(
+                    self.channel_layer, user_stream(self.username)
+                )
+                await self.fetch_display_name()
+                await self.fetch_notifications()
+            else:
+                await self.replay_user_events(missed_events)
+                self.replayed_seq = self.user_seq
         else:
             await self.close()
 
     async def disconnect(self, close_code):
         await self.channel_layer.group_discard(self.username, self.channel_name)
+        if self.pending_refresh:
+            self.pending_refresh.cancel()
 
     async def receive_json(self, content, **kwargs):
         if self.username == self.user.username:
@@ -53,45 +111,142 @@ class UserConsumer(AsyncJsonWebsocketConsumer):
                 asyncio.create_task(self.update_display_name(content))
             if content.get("command") == "fetch_registered_contacts":
                 asyncio.create_task(self.fetch_registered_contacts(content))
+            if content.get("command") == "sync_contacts":
+                asyncio.create_task(self.sync_contacts(content))
             if content.get("command") == "save_fcm_token":
                 asyncio.create_task(self.save_fcm_token(content))
+            if content.get("command") == "fetch_notifications":
+                self.inbox_versions = {}
+                asyncio.create_task(self.fetch_notifications())
 
     async def save_fcm_token(self, input_payload):
         fcm_token = input_payload["registration_token"]
         await database_sync_to_async(self.save_user_fcm_token)(fcm_token)
 
     async def fetch_registered_contacts(self, input_payload):
-        phone_contacts = input_payload["phone_contacts"]
+        stream = input_payload.get("stream", False)
         valid_phone_numbers = []
-        for contact in phone_contacts:
-            if contact["phoneNumbers"]:
-                phone_number = next(
-                    (
-                        number["number"]
-                        for number in contact["phoneNumbers"]
-                        if number["label"] == "mobile"
-                    ),
-                    contact["phoneNumbers"][0]["number"],
+        async for phone_numbers in normalize_phone_contacts_in_chunks(
+            input_payload["phone_contacts"], self.user.alpha2_country_code
+        ):
+            if stream:
+                phone_numbers = set(phone_numbers).difference(valid_phone_numbers)
+                registered_contacts = await database_sync_to_async(
+                    self.find_users_by_phone_numbers
+                )(phone_numbers)
+                await self.channel_layer.send(
+                    self.channel_name,
+                    {
+                        "type": "registered_contacts",
+                        "registered_contacts": registered_contacts,
+                        "done": False,
+                    },
                 )
-                try:
-                    phone_number = phonenumbers.parse(
-                        phone_number, self.user.alpha2_country_code
-                    )
-                    if phonenumbers.is_valid_number(phone_number):
-                        phone_number = phonenumbers.format_number(
-                            phone_number, phonenumbers.PhoneNumberFormat.E164
-                        )
-                        valid_phone_numbers.append(phone_number)
-                except NumberParseException:
-                    pass
-        registered_contacts = await database_sync_to_async(
-            self.find_users_by_phone_numbers
-        )(valid_phone_numbers)
+            valid_phone_numbers += phone_numbers
+        digest = await database_sync_to_async(self.replace_contacts)(
+            set(valid_phone_numbers)
+        )
+        if stream:
+            registered_contacts = []
+        else:
+            registered_contacts = await database_sync_to_async(
+                self.find_users_by_phone_numbers
+            )(valid_phone_numbers)
         await self.channel_layer.send(
             self.channel_name,
-            {"type": "registered_contacts", "registered_contacts": registered_contacts},
+            {
+                "type": "registered_contacts",
+                "registered_contacts": registered_contacts,
+                "digest": digest,
+                "done": True,
+            },
+        )
+
+    async def sync_contacts(self, input_payload):
+        added_phone_numbers = []
+        async for phone_numbers in normalize_phone_contacts_in_chunks(
+            input_payload.get("added", []), self.user.alpha2_country_code
+        ):
+            added_phone_numbers += phone_numbers
+        removed_phone_numbers = []
+        async for phone_numbers in normalize_phone_contacts_in_chunks(
+            input_payload.get("removed", []), self.user.alpha2_country_code
+        ):
+            removed_phone_numbers += phone_numbers
+        contacts_sync = await database_sync_to_async(self.apply_contact_changes)(
+            set(added_phone_numbers),
+            set(removed_phone_numbers),
+            input_payload.get("digest"),
+            input_payload.get("reset", False),
+        )
+        await self.channel_layer.send(
+            self.channel_name, {"type": "contacts_sync", **contacts_sync}
         )
 
+    def apply_contact_changes(
+        self, added_phone_numbers, removed_phone_numbers, digest, reset
+    ):
+        with transaction.atomic():
+            user = User.objects.select_for_update().get(id=self.user.id)
+            if reset:
+                user.contacts.all().delete()
+                user.contacts_digest = EMPTY_CONTACTS_DIGEST
+            elif digest != user.contacts_digest:
+                return {
+                    "resync_required": True,
+                    "digest": user.contacts_digest,
+                    "registered": [],
+                    "unregistered": [],
+                }
+            existing_phone_numbers = set(
+                user.contacts.filter(
+                    phone_number__in=added_phone_numbers | removed_phone_numbers
+                ).values_list("phone_number", flat=True)
+            )
+            removed_phone_numbers = (
+                removed_phone_numbers - added_phone_numbers
+            ) & existing_phone_numbers
+            added_phone_numbers = added_phone_numbers - existing_phone_numbers
+            self.store_contact_changes(user, added_phone_numbers, removed_phone_numbers)
+        unregistered_phone_numbers = (
+            User.objects.filter(phone_number__in=removed_phone_numbers)
+            .exclude(phone_number=self.user.phone_number)
+            .values_list("phone_number", flat=True)
+        )
+        return {
+            "resync_required": False,
+            "digest": user.contacts_digest,
+            "registered": self.find_users_by_phone_numbers(added_phone_numbers),
+            "unregistered": list(unregistered_phone_numbers),
+        }
+
+    def store_contact_changes(self, user, added_phone_numbers, removed_phone_numbers):
+        Contact.objects.bulk_create(
+            [
+                Contact(owner=user, phone_number=phone_number)
+                for phone_number in added_phone_numbers
+            ],
+            ignore_conflicts=True,
+        )
+        user.contacts.filter(phone_number__in=removed_phone_numbers).delete()
+        user.contacts_digest = update_contacts_digest(
+            user.contacts_digest, added_phone_numbers | removed_phone_numbers
+        )
+        user.save(update_fields=["contacts_digest"])
+
+    def replace_contacts(self, phone_numbers):
+        with transaction.atomic():
+            user = User.objects.select_for_update().get(id=self.user.id)
+            existing_phone_numbers = set(
+                user.contacts.values_list("phone_number", flat=True)
+            )
+            self.store_contact_changes(
+                user,
+                phone_numbers - existing_phone_numbers,
+                existing_phone_numbers - phone_numbers,
+            )
+        return user.contacts_digest
+
     def save_user_fcm_token(self, fcm_token):
         self.user.fcm_registration_token = fcm_token
         self.user.save()
@@ -105,82 +260,179 @@ class UserConsumer(AsyncJsonWebsocketConsumer):
         )
         return list(users)
 
+    async def replay_user_events(self, events):
+        display_name_events = [
+            event for event in events if event["type"] == "display_name"
+        ]
+        refreshed_rooms = {
+            event.get("room")
+            for event in events
+            if event["type"] == "refresh_notifications"
+        }
+        if events:
+            self.user_seq = events[-1]["seq"]
+        for event in events:
+            if event["type"] == "contacts_sync":
+                await self.contacts_sync(event)
+        if display_name_events:
+            await self.display_name(display_name_events[-1])
+        if self.inbox_delta and refreshed_rooms and None not in refreshed_rooms:
+            await self.fetch_notification_changes(refreshed_rooms)
+        elif refreshed_rooms:
+            await self.fetch_notifications()
+
     async def fetch_display_name(self):
         display_name = self.user.display_name
-        await self.channel_layer.group_send(
-            self.username,
-            {"type": "display_name", "display_name": display_name},
+        await self.send_json(
+            {
+                "type": "display_name",
+                "display_name": display_name,
+                "seq": self.user_seq,
+            }
         )
 
+    def is_replayed(self, event):
+        return "seq" in event and event["seq"] <= self.replayed_seq
+
     def change_display_name(self, new_name):
         self.user.display_name = new_name
         self.user.save()
+        direct_rooms = (
+            Room.objects.annotate(num_members=Count("members"))
+            .filter(num_members=2, members=self.user)
+            .values("pk")
+        )
+        UserRoomNotification.objects.filter(room__in=direct_rooms).exclude(
+            user=self.user
+        ).update(room_display_name=new_name, version=F("version") + 1)
+        UserRoomNotification.objects.filter(message__creator=self.user).update(
+            last_message_creator_display_name=new_name, version=F("version") + 1
+        )
         return new_name
 
-    def get_notifications(self):
+    def get_notifications(self, rooms=None):
+        notifications = self.user.userroomnotification_set.all()
+        if rooms is not None:
+            notifications = notifications.filter(room__in=rooms)
         notifications = list(
-            self.user.userroomnotification_set.annotate(
-                member_phone_numbers=ArrayAgg("room__members__phone_number")
-            )
-            .annotate(
-                is_own_message=Case(
-                    When(message__creator=self.user, then=True),
-                    default=False,
-                    output_field=BooleanField(),
-                )
-            )
-            .values(
+            notifications.values(
                 "member_phone_numbers",
                 "room",
-                "room__display_name",
+                "room_display_name",
                 "timestamp",
                 "read",
-                "message__creator__display_name",
+                "last_message_creator_display_name",
                 "is_own_message",
-            )
-            .order_by("read", "-timestamp")
+                "version",
+                "unread_count",
+            ).order_by("read", "-timestamp")
         )
         for notification in notifications:
             notification["room"] = str(notification["room"])
             notification["timestamp"] = notification["timestamp"].timestamp()
-            if len(notification["member_phone_numbers"]) == 2:
-                receiver_phone_number = next(
-                    phone_number
-                    for phone_number in notification["member_phone_numbers"]
-                    if phone_number != self.user.phone_number
-                )
-                notification["room__display_name"] = User.objects.get(
-                    phone_number=receiver_phone_number
-                ).display_name
+            notification["room__display_name"] = notification.pop("room_display_name")
+            notification["message__creator__display_name"] = notification.pop(
+                "last_message_creator_display_name"
+            )
         return notifications
 
+    def get_notification_changes(self, known_versions, missed_rooms=None):
+        versions = {
+            str(room): version
+            for room, version in self.user.userroomnotification_set.values_list(
+                "room", "version"
+            )
+        }
+        if missed_rooms is not None:
+            known_versions = {
+                room: version
+                for room, version in versions.items()
+                if room not in missed_rooms
+            }
+            known_versions.update(dict.fromkeys(missed_rooms))
+        changed_rooms = [
+            room
+            for room, version in versions.items()
+            if known_versions.get(room) != version
+        ]
+        removed_rooms = [room for room in known_versions if room not in versions]
+        changed_notifications = (
+            self.get_notifications(changed_rooms) if changed_rooms else []
+        )
+        return (
+            changed_notifications,
+            removed_rooms,
+            versions,
+            self.get_total_unread_count(),
+        )
+
+    def get_total_unread_count(self):
+        return User.objects.values_list("unread_count", flat=True).get(id=self.user.id)
+
     async def update_display_name(self, input_payload):
         if len(input_payload["name"].strip()) > 0:
             display_name = await database_sync_to_async(self.change_display_name)(
                 input_payload["name"].strip()
             )
-            await self.channel_layer.group_send(
-                self.username,
+            await send_user_event(
+                self.channel_layer,
+                [self.username],
                 {"type": "display_name", "display_name": display_name},
             )
         else:
             await self.fetch_display_name()
 
     async def fetch_notifications(self):
+        if self.inbox_delta:
+            await self.fetch_notification_changes()
+            return
         notifications = await database_sync_to_async(self.get_notifications)()
-        await self.channel_layer.group_send(
-            self.username,
+        total_unread_count = await database_sync_to_async(self.get_total_unread_count)()
+        await self.channel_layer.send(
+            self.channel_name,
             {
                 "type": "notifications",
                 "notifications": notifications,
+                "total_unread_count": total_unread_count,
+                "seq": self.user_seq,
             },
         )
 
+    async def fetch_notification_changes(self, missed_rooms=None):
+        reset = not self.inbox_versions and missed_rooms is None
+        (
+            changed_notifications,
+            removed_rooms,
+            self.inbox_versions,
+            total_unread_count,
+        ) = await database_sync_to_async(self.get_notification_changes)(
+            self.inbox_versions, missed_rooms
+        )
+        if reset or changed_notifications or removed_rooms:
+            await self.channel_layer.send(
+                self.channel_name,
+                {
+                    "type": "notifications_delta",
+                    "reset": reset,
+                    "upserts": changed_notifications,
+                    "removals": removed_rooms,
+                    "total_unread_count": total_unread_count,
+                    "seq": self.user_seq,
+                },
+            )
+
     async def notifications(self, event):
         # Send message to WebSocket
         await self.send_json(event)
 
+    async def notifications_delta(self, event):
+        # Send message to WebSocket
+        await self.send_json(event)
+
     async def display_name(self, event):
+        if self.is_replayed(event):
+            return
+        self.user_seq = max(self.user_seq, event["seq"])
         # Send message to WebSocket
         await self.send_json(event)
 
@@ -188,8 +440,26 @@ class UserConsumer(AsyncJsonWebsocketConsumer):
         # Send message to WebSocket
         await self.send_json(event)
 
-    async def refresh_notifications(self, event):
+    async def contacts_sync(self, event):
+        if self.is_replayed(event):
+            return
+        self.user_seq = max(self.user_seq, event.get("seq", 0))
         # Send message to WebSocket
+        await self.send_json(event)
+
+    async def refresh_notifications(self, event):
+        if self.is_replayed(event):
+            return
+        self.user_seq = max(self.user_seq, event["seq"])
+        metrics.increment("notifications.refresh_requested")
+        if self.pending_refresh is None:
+            self.pending_refresh = asyncio.create_task(self.debounce_refresh())
+        else:
+            metrics.increment("notifications.refresh_coalesced")
+
+    async def debounce_refresh(self):
+        await asyncio.sleep(settings.NOTIFICATIONS_REFRESH_DEBOUNCE)
+        self.pending_refresh = None
         await self.fetch_notifications()
 
 
@@ -197,24 +467,68 @@ def serialize_msg_notification(notification):
     notification["id"] = str(notification["id"])
     notification["message__id"] = str(notification["message__id"])
     notification["timestamp"] = notification["timestamp"].timestamp()
-    notification["url"] = generate_download_signed_url_v4(notification["message__id"])
     return notification
 
 
+async def sign_msg_notifications(notifications):
+    urls = await generate_download_signed_urls_v4(
+        [notification["message__id"] for notification in notifications]
+    )
+    for notification, url in zip(notifications, urls):
+        notification["url"] = url
+    return notifications
+
+
 class RoomConsumer(AsyncJsonWebsocketConsumer):
     def __init__(self, *args, **kwargs):
         super().__init__(args, kwargs)
         self.user = None
         self.room_id = None
+        self.room_allowed = False
+        self.presence_heartbeat = None
+        self.replayed_seq = 0
 
-    def get_message_notifications(self):
+    def get_room_message_notifications(self, message_ids=None):
         room = Room.objects.get(id=self.room_id)
         room_member_pks = room.members.all().values_list("pk", flat=True)
-        latest_notification = (
-            self.user.messagenotification_set.filter(
-                room__id=self.room_id, message__creator__id__in=room_member_pks
+        if room.message_log:
+            messages = room.message_set.filter(creator__id__in=room_member_pks)
+            if message_ids is not None:
+                messages = messages.filter(id__in=message_ids)
+            if not room.message_log_backfilled:
+                legacy_notification = MessageNotification.objects.filter(
+                    message=OuterRef("pk"), receiver=self.user
+                )
+                messages = messages.filter(
+                    Q(seq__isnull=False) | Exists(legacy_notification)
+                )
+            return (
+                messages.exclude(creator__in=self.user.blocked_users.all())
+                .exclude(hiddenmessage__user=self.user)
+                .annotate(
+                    timestamp=F("created_at"),
+                    is_own_message=Case(
+                        When(creator=self.user, then=True),
+                        default=False,
+                        output_field=BooleanField(),
+                    ),
+                )
+                .values(
+                    "id",
+                    "timestamp",
+                    "is_own_message",
+                    message__id=F("id"),
+                    message__creator__display_name=F("creator__display_name"),
+                )
+                .order_by("-timestamp", "-id")
             )
-            .annotate(
+        notifications = self.user.messagenotification_set.filter(
+            room__id=self.room_id, message__creator__id__in=room_member_pks
+        ).exclude(message__creator__in=self.user.blocked_users.all())
+        if message_ids is not None:
+            notifications = notifications.filter(message__id__in=message_ids)
+        return (
+            notifications.annotate(
                 is_own_message=Case(
                     When(message__creator=self.user, then=True),
                     default=False,
@@ -228,114 +542,244 @@ class RoomConsumer(AsyncJsonWebsocketConsumer):
                 "message__creator__display_name",
                 "is_own_message",
             )
-            .order_by("timestamp")
-            .last()
+            .order_by("-timestamp", "-id")
         )
+
+    def get_message_notifications(self):
+        latest_notification = self.get_room_message_notifications().first()
         notifications = []
         if latest_notification:
             latest_notification = serialize_msg_notification(latest_notification)
             notifications.append(latest_notification)
         return notifications
 
-    def read_unread_room_notification(self):
-        room = Room.objects.get(id=self.room_id)
-        UserRoomNotification.objects.filter(
-            user=self.user, room=room, read=False
-        ).update(read=True)
+    def get_message_history(self, cursor):
+        notifications = self.get_room_message_notifications()
+        if cursor:
+            if not isinstance(cursor, str):
+                return [], None
+            try:
+                timestamp, notification_id = cursor.split(",")
+                timestamp = datetime.datetime.fromisoformat(timestamp)
+                notification_id = uuid.UUID(notification_id)
+            except ValueError:
+                return [], None
+            notifications = notifications.filter(
+                Q(timestamp__lt=timestamp)
+                | Q(timestamp=timestamp, id__lt=notification_id)
+            )
+        page_size = settings.MESSAGE_HISTORY_PAGE_SIZE
+        notifications = list(notifications[: page_size + 1])
+        next_cursor = None
+        if len(notifications) > page_size:
+            notifications = notifications[:page_size]
+            last_notification = notifications[-1]
+            next_cursor = (
+                f"{last_notification['timestamp'].isoformat()},"
+                f"{last_notification['id']}"
+            )
+        return [
+            serialize_msg_notification(notification) for notification in notifications
+        ], next_cursor
 
-    def get_new_message_notification_event(self, event):
-        message = Message.objects.get(id=event["message_id"])
-        notification = (
-            message.messagenotification_set.filter(receiver=self.user)
-            .annotate(
-                is_own_message=Case(
-                    When(message__creator=self.user, then=True),
-                    default=False,
-                    output_field=BooleanField(),
-                )
+    def get_replayed_message_notifications(self, message_ids):
+        return [
+            serialize_msg_notification(notification)
+            for notification in self.get_room_message_notifications(message_ids)
+        ]
+
+    def read_unread_room_notification(self):
+        with transaction.atomic():
+            room = Room.objects.select_for_update().get(id=self.room_id)
+            notification = (
+                UserRoomNotification.objects.select_for_update()
+                .filter(user=self.user, room=room)
+                .exclude(read=True, read_seq__gte=room.message_seq, unread_count=0)
+                .first()
             )
-            .values(
-                "id",
-                "message__id",
-                "timestamp",
-                "message__creator__display_name",
-                "is_own_message",
+            if not notification:
+                return
+            UserRoomNotification.objects.filter(id=notification.id).update(
+                read=True,
+                read_seq=room.message_seq,
+                unread_count=0,
+                version=F("version") + 1,
             )
+            update_unread_counts({self.user.id: -notification.unread_count})
+
+    def take_unread_count(self):
+        notification = (
+            UserRoomNotification.objects.select_for_update()
+            .filter(user=self.user, room__id=self.room_id, unread_count__gt=0)
             .first()
         )
-        if notification:
-            event["message"] = serialize_msg_notification(notification)
-            return event
+        if not notification:
+            return 0
+        UserRoomNotification.objects.filter(id=notification.id).update(
+            unread_count=0, version=F("version") + 1
+        )
+        return notification.unread_count
 
-    def update_notifications_for_new_message(self, message):
-        room = Room.objects.get(id=self.room_id)
-        for user in room.members.all():
-            if not user.blocked_users.filter(id=self.user.id).exists():
-                notification = UserRoomNotification.objects.get(user=user, room=room)
-                notification.message = message
-                notification.read = user == self.user
-                notification.save()
-
-    def create_message_notifications_for_new_message(self, message):
-        room = Room.objects.get(id=self.room_id)
-        for user in room.members.all():
-            if not user.blocked_users.filter(id=self.user.id).exists():
-                notification, created = MessageNotification.objects.get_or_create(
-                    receiver=user, room=room, message=message
+    def forget_unread_message(self, message):
+        if message.seq is None or message.creator_id == self.user.id:
+            return
+        forgotten = UserRoomNotification.objects.filter(
+            user=self.user,
+            room=message.room,
+            read_seq__lt=message.seq,
+            unread_count__gt=0,
+        ).update(unread_count=F("unread_count") - 1, version=F("version") + 1)
+        if forgotten:
+            update_unread_counts({self.user.id: -1})
+
+    def forget_unread_messages_from(self, creator):
+        notifications = UserRoomNotification.objects.select_for_update().filter(
+            user=self.user, room__members=creator, unread_count__gt=0
+        )
+        visible_messages = (
+            Message.objects.filter(creator=creator, seq__isnull=False)
+            .exclude(hiddenmessage__user=self.user)
+            .filter(
+                Q(room__message_log=True) | Q(messagenotification__receiver=self.user)
+            )
+        )
+        total_forgotten = 0
+        for notification in notifications:
+            unread_messages = visible_messages.filter(
+                room__id=notification.room_id, seq__gt=notification.read_seq
+            ).count()
+            forgotten = min(unread_messages, notification.unread_count)
+            if forgotten:
+                UserRoomNotification.objects.filter(id=notification.id).update(
+                    unread_count=F("unread_count") - forgotten,
+                    version=F("version") + 1,
                 )
-                notification.save()
+                total_forgotten += forgotten
+        update_unread_counts({self.user.id: -total_forgotten})
 
-    def send_push_notifications_for_new_message(self, message):
-        room = Room.objects.get(id=self.room_id)
-        registration_tokens = [
-            user.fcm_registration_token
-            for user in room.members.all()
-            if not user.blocked_users.filter(id=self.user.id).exists()
-            and user.id != self.user.id
+    def fan_out_new_message(self, message):
+        has_blocked_sender = User.blocked_users.through.objects.filter(
+            from_user=OuterRef("pk"), to_user=self.user
+        )
+        members = list(
+            User.objects.filter(room__id=self.room_id)
+            .annotate(has_blocked_sender=Exists(has_blocked_sender))
+            .values("id", "username", "fcm_registration_token", "has_blocked_sender")
+        )
+        recipients = [member for member in members if not member["has_blocked_sender"]]
+        push_recipients = [
+            member
+            for member in recipients
+            if member["id"] != self.user.id and member["fcm_registration_token"]
         ]
-        notification = messaging.Notification(
-            title=f"{message.creator.display_name} spoke"
-            if message.room.members.count() == 2
-            else message.room.display_name,
-            body=None
-            if message.room.members.count() == 2
-            else f"{message.creator.display_name} spoke",
-            image=None,
+        # Log rooms skip the per-member MessageNotification inserts, but every
+        # recipient's inbox row and unread total is still updated here so the
+        # inbox and push badges stay plain column reads.
+        with transaction.atomic():
+            self.assign_message_seq(message)
+            if not message.room.message_log:
+                self.write_message_notifications(message, recipients)
+            unread_count_changes = {recipient["id"]: 1 for recipient in recipients}
+            unread_count_changes[self.user.id] = -self.take_unread_count()
+            self.update_inbox_rows(message, recipients)
+            update_unread_counts(unread_count_changes)
+            total_unread_counts = dict(
+                User.objects.filter(
+                    id__in=[member["id"] for member in push_recipients]
+                ).values_list("id", "unread_count")
+            )
+        member_usernames = [member["username"] for member in members]
+        excluded_usernames = [
+            member["username"] for member in members if member["has_blocked_sender"]
+        ]
+        push_recipients = {
+            member["username"]: (
+                member["fcm_registration_token"],
+                total_unread_counts.get(member["id"], 0),
+            )
+            for member in push_recipients
+        }
+        return member_usernames, push_recipients, excluded_usernames
+
+    def write_message_notifications(self, message, recipients):
+        MessageNotification.objects.bulk_create(
+            [
+                MessageNotification(
+                    receiver_id=recipient["id"], room_id=self.room_id, message=message
+                )
+                for recipient in recipients
+            ],
+            ignore_conflicts=True,
+        )
+
+    def assign_message_seq(self, message):
+        room = Room.objects.select_for_update().get(id=self.room_id)
+        room.message_seq += 1
+        room.save(update_fields=["message_seq"])
+        message.seq = room.message_seq
+        message.save(update_fields=["seq"])
+
+    def update_inbox_rows(self, message, recipients):
+        is_own_message = Case(
+            When(user=self.user, then=True),
+            default=False,
+            output_field=BooleanField(),
+        )
+        UserRoomNotification.objects.filter(
+            room__id=self.room_id,
+            user__id__in=[recipient["id"] for recipient in recipients],
+        ).update(
+            message=message,
+            read=is_own_message,
+            is_own_message=is_own_message,
+            last_message_creator_display_name=self.user.display_name,
+            timestamp=timezone.now(),
+            read_seq=Case(
+                When(user=self.user, then=message.seq),
+                default=F("read_seq"),
+                output_field=PositiveIntegerField(),
+            ),
+            unread_count=Case(
+                When(user=self.user, then=0),
+                default=F("unread_count") + 1,
+                output_field=PositiveIntegerField(),
+            ),
+            version=F("version") + 1,
         )
-        android_config = messaging.AndroidConfig(
-            priority="high", notification=messaging.AndroidNotification(priority="max")
+
+    async def send_push_notifications_for_new_message(
+        self, message, push_recipients, num_members
+    ):
+        present_usernames = await get_present_usernames(
+            self.channel_layer, self.room_id
         )
-        push_message = messaging.MulticastMessage(
-            tokens=registration_tokens,
-            notification=notification,
-            android=android_config,
+        push_dispatcher.enqueue(
+            self.room_id,
+            None if num_members == 2 else message.room.display_name,
+            message.creator.display_name,
+            {
+                registration_token: badge
+                for username, (registration_token, badge) in push_recipients.items()
+                if username not in present_usernames
+            },
         )
-        messaging.send_multicast(push_message)
 
     def get_room(self, phone_numbers):
         usernames_to_notify = []
         phone_numbers.append(self.user.phone_number)
-        members_to_be_added = User.objects.filter(phone_number__in=phone_numbers)
-        rooms_with_members = Room.objects.filter(
-            members__in=members_to_be_added
-        ).distinct()
-        room = None
-        for room_with_members in rooms_with_members:
-            existing_room_members = set(room_with_members.members.all())
-            if existing_room_members == set(members_to_be_added):
-                if not room:
-                    room = room_with_members
-                else:
-                    room_with_members.delete()
+        members_to_be_added = list(User.objects.filter(phone_number__in=phone_numbers))
+        member_key = get_member_key(member.id for member in members_to_be_added)
+        room = Room.objects.filter(member_key=member_key).first()
         if not room:
-            room = Room.objects.create(display_name="Change the group name")
-            room.members.add(*members_to_be_added)
-            for user in room.members.all():
-                UserRoomNotification.objects.create(user=user, room=room)
-            usernames_to_notify = [
-                notification.user.username
-                for notification in room.userroomnotification_set.all()
-            ]
+            try:
+                with transaction.atomic():
+                    room = self.create_room(members_to_be_added, member_key)
+            except IntegrityError:
+                room = Room.objects.get(member_key=member_key)
+            else:
+                usernames_to_notify = [
+                    member.username for member in members_to_be_added
+                ]
         self.room_id = str(room.id)
         user_allowed = self.user_allowed()
         if user_allowed:
@@ -352,6 +796,31 @@ class RoomConsumer(AsyncJsonWebsocketConsumer):
         else:
             raise UserNotAllowedError("User is not a member of the room")
 
+    def create_room(self, room_members, member_key):
+        message_log = len(room_members) > settings.MESSAGE_LOG_MEMBER_THRESHOLD
+        room = Room.objects.create(
+            display_name="Change the group name",
+            member_key=member_key,
+            message_log=message_log,
+            message_log_backfilled=message_log,
+        )
+        room.members.add(*room_members)
+        member_phone_numbers = sorted(user.phone_number for user in room_members)
+        for user in room_members:
+            if len(room_members) == 2:
+                room_display_name = next(
+                    member.display_name for member in room_members if member != user
+                )
+            else:
+                room_display_name = room.display_name
+            UserRoomNotification.objects.create(
+                user=user,
+                room=room,
+                room_display_name=room_display_name,
+                member_phone_numbers=member_phone_numbers,
+            )
+        return room
+
     def user_allowed(self):
         room = Room.objects.filter(id=self.room_id)
         if room.exists():
@@ -366,6 +835,9 @@ class RoomConsumer(AsyncJsonWebsocketConsumer):
         if len(room.members.all()) > 2:
             room.display_name = new_name
             room.save()
+            room.userroomnotification_set.update(
+                room_display_name=new_name, version=F("version") + 1
+            )
             usernames_to_notify = [
                 notification.user.username
                 for notification in room.userroomnotification_set.all()
@@ -379,33 +851,47 @@ class RoomConsumer(AsyncJsonWebsocketConsumer):
         )
         return message, created
 
-    def get_all_room_members(self):
-        room = Room.objects.filter(id=self.room_id)
-        if room.exists():
-            room = room.first()
-            members = room.members.all().values()
-        else:
-            members = []
-        member_display_names = [user["display_name"] for user in members]
-        member_usernames = [user["username"] for user in members]
-        return member_display_names, member_usernames
+    def get_notified_message(self, notification_id):
+        room = Room.objects.get(id=self.room_id)
+        if room.message_log:
+            return room.message_set.select_related("creator").get(id=notification_id)
+        return (
+            self.user.messagenotification_set.select_related(
+                "message__creator", "message__room"
+            )
+            .get(Q(id=notification_id) | Q(message__id=notification_id), room=room)
+            .message
+        )
 
     def report_message_notification(self, notification_id):
-        notification = MessageNotification.objects.get(id=notification_id)
+        message = self.get_notified_message(notification_id)
         Report.objects.get_or_create(
             reporter=self.user,
-            reported_user=notification.message.creator,
-            message=notification.message,
+            reported_user=message.creator,
+            message=message,
         )
 
     def delete_message_notification(self, notification_id):
-        notification = MessageNotification.objects.get(id=notification_id)
-        notification.delete()
+        message = self.get_notified_message(notification_id)
+        with transaction.atomic():
+            hidden = False
+            if message.room.message_log:
+                hidden_message, hidden = HiddenMessage.objects.get_or_create(
+                    user=self.user, message=message
+                )
+            if not message.room.message_log_backfilled:
+                deleted, _ = self.user.messagenotification_set.filter(
+                    message=message
+                ).delete()
+                hidden = hidden or deleted
+            if hidden:
+                self.forget_unread_message(message)
 
     def block_message_notification_user(self, notification_id):
-        notification = MessageNotification.objects.get(id=notification_id)
-        user_to_block = notification.message.creator
-        self.user.blocked_users.add(user_to_block)
+        user_to_block = self.get_notified_message(notification_id).creator
+        with transaction.atomic():
+            self.user.blocked_users.add(user_to_block)
+            self.forget_unread_messages_from(user_to_block)
 
     def phone_numbers_all_valid(self, phone_numbers):
         if len(User.objects.filter(phone_number__in=phone_numbers)) != len(
@@ -421,10 +907,27 @@ class RoomConsumer(AsyncJsonWebsocketConsumer):
         self.room_id = None
 
     async def disconnect(self, close_code):
+        await self.leave_room()
+
+    async def leave_room(self):
+        self.room_allowed = False
         if self.room_id:
             await self.channel_layer.group_discard(self.room_id, self.channel_name)
+            if self.presence_heartbeat:
+                self.presence_heartbeat.cancel()
+                self.presence_heartbeat = None
+            await mark_absent(
+                self.channel_layer, self.room_id, self.user.username, self.channel_name
+            )
+
+    async def keep_presence(self, room_id):
+        while True:
+            await asyncio.sleep(settings.PRESENCE_HEARTBEAT_INTERVAL)
+            await mark_present(
+                self.channel_layer, room_id, self.user.username, self.channel_name
+            )
 
-    async def initialize_room(self, members):
+    async def initialize_room(self, members, last_seq=None):
         (
             room,
             members,
@@ -433,44 +936,93 @@ class RoomConsumer(AsyncJsonWebsocketConsumer):
         ) = await database_sync_to_async(
             self.get_room
         )(members)
-        await self.channel_layer.send(
-            self.channel_name,
-            {"type": "new_room", "room_name": room_name, "room_members": members},
-        )
+        self.room_allowed = True
+        self.replayed_seq = 0
         await self.channel_layer.group_add(self.room_id, self.channel_name)
-        for username in usernames_to_notify:
-            await self.channel_layer.group_send(
-                username, {"type": "refresh_notifications"}
+        await mark_present(
+            self.channel_layer, self.room_id, self.user.username, self.channel_name
+        )
+        self.presence_heartbeat = asyncio.create_task(self.keep_presence(self.room_id))
+        if usernames_to_notify:
+            await send_user_event(
+                self.channel_layer,
+                usernames_to_notify,
+                {"type": "refresh_notifications", "room": self.room_id},
+            )
+        missed_events = None
+        if last_seq is not None:
+            missed_events = await replay_events(
+                self.channel_layer, room_stream(self.room_id), last_seq
+            )
+        if missed_events is None:
+            seq = await get_current_seq(self.channel_layer, room_stream(self.room_id))
+            await self.channel_layer.send(
+                self.channel_name,
+                {
+                    "type": "new_room",
+                    "room_name": room_name,
+                    "room_members": members,
+                    "seq": seq,
+                },
             )
-        await self.fetch_upload_url()
-        await self.fetch_message_notifications()
+            await self.fetch_upload_url()
+            await self.fetch_message_notifications()
+        else:
+            await self.fetch_upload_url()
+            await self.replay_room_events(missed_events)
+            self.replayed_seq = missed_events[-1]["seq"] if missed_events else last_seq
         await self.channel_layer.send(
             self.channel_name,
             {"type": "room_notified"},
         )
 
+    async def replay_room_events(self, events):
+        message_ids = [
+            event["message_id"] for event in events if event["type"] == "new_message"
+        ]
+        message_notifications = {}
+        if message_ids:
+            message_notifications = await database_sync_to_async(
+                self.get_replayed_message_notifications
+            )(message_ids)
+            await sign_msg_notifications(message_notifications)
+            message_notifications = {
+                notification["message__id"]: notification
+                for notification in message_notifications
+            }
+        for event in events:
+            if event["type"] != "new_message":
+                await self.dispatch(event)
+            elif event["message_id"] in message_notifications:
+                await self.send_json(
+                    {
+                        "type": "new_message",
+                        "message_id": event["message_id"],
+                        "message": message_notifications[event["message_id"]],
+                        "seq": event["seq"],
+                    }
+                )
+
     async def receive_json(self, content, **kwargs):
         if content.get("command") == "connect":
-            if self.room_id:
-                await self.channel_layer.group_discard(self.room_id, self.channel_name)
+            await self.leave_room()
             phone_numbers = content.get("phone_numbers", [])
             valid = await database_sync_to_async(self.phone_numbers_all_valid)(
                 phone_numbers
             )
             if valid:
-                await self.initialize_room(phone_numbers)
+                await self.initialize_room(
+                    phone_numbers, parse_seq(content.get("last_seq"))
+                )
             else:
-                await self.channel_layer.group_send(
-                    self.user.username,
-                    {
-                        "type": "refresh_notifications",
-                    },
+                await send_user_event(
+                    self.channel_layer,
+                    [self.user.username],
+                    {"type": "refresh_notifications"},
                 )
         if content.get("command") == "disconnect":
-            if self.room_id:
-                await self.channel_layer.group_discard(self.room_id, self.channel_name)
-        user_allowed = await database_sync_to_async(self.user_allowed)()
-        if user_allowed:
+            await self.leave_room()
+        if self.room_allowed:
             if content.get("command") == "update_room_name":
                 asyncio.create_task(self.update_room_name(content))
             if content.get("command") == "fetch_upload_url":
@@ -479,6 +1031,8 @@ class RoomConsumer(AsyncJsonWebsocketConsumer):
                 asyncio.create_task(self.send_message(content))
             if content.get("command") == "fetch_message_notifications":
                 asyncio.create_task(self.fetch_message_notifications())
+            if content.get("command") == "fetch_message_history":
+                asyncio.create_task(self.fetch_message_history(content))
             if content.get("command") == "report_message_notification":
                 asyncio.create_task(self.report_msg_notification(content))
             if content.get("command") == "delete_message_notification":
@@ -513,30 +1067,36 @@ class RoomConsumer(AsyncJsonWebsocketConsumer):
         if filename:
             message, created = await database_sync_to_async(self.get_message)(filename)
             if message and created:
-                await database_sync_to_async(self.update_notifications_for_new_message)(
-                    message
+                (
+                    room_member_usernames,
+                    push_recipients,
+                    excluded_usernames,
+                ) = await database_sync_to_async(self.fan_out_new_message)(message)
+                url = await generate_download_signed_url_v4(str(message.id))
+                await self.send_push_notifications_for_new_message(
+                    message, push_recipients, len(room_member_usernames)
                 )
-                await database_sync_to_async(
-                    self.create_message_notifications_for_new_message
-                )(message)
-                await database_sync_to_async(
-                    self.send_push_notifications_for_new_message
-                )(message)
-                await self.channel_layer.group_send(
+                await send_room_event(
+                    self.channel_layer,
                     self.room_id,
                     {"type": "new_message", "message_id": str(message.id)},
+                    message=serialize_msg_notification(
+                        {
+                            "id": message.id,
+                            "message__id": message.id,
+                            "timestamp": message.created_at,
+                            "message__creator__display_name": self.user.display_name,
+                            "url": url,
+                        }
+                    ),
+                    creator=self.user.username,
+                    excluded_usernames=excluded_usernames,
                 )
-                (
-                    room_member_display_names,
+                await send_user_event(
+                    self.channel_layer,
                     room_member_usernames,
-                ) = await database_sync_to_async(self.get_all_room_members)()
-                for username in room_member_usernames:
-                    await self.channel_layer.group_send(
-                        username,
-                        {
-                            "type": "refresh_notifications",
-                        },
-                    )
+                    {"type": "refresh_notifications", "room": self.room_id},
+                )
                 await self.channel_layer.group_send(
                     self.room_id,
                     {"type": "room_notified"},
@@ -547,25 +1107,41 @@ class RoomConsumer(AsyncJsonWebsocketConsumer):
         message_notifications = await database_sync_to_async(
             self.get_message_notifications
         )()
+        await sign_msg_notifications(message_notifications)
         await self.channel_layer.send(
             self.channel_name,
             {
                 "type": "message_notifications",
                 "message_notifications": message_notifications,
-                "refresh_message_notifications_in": 604790000,
+                "refresh_message_notifications_in": SIGNED_URL_REFRESH_IN,
+            },
+        )
+
+    async def fetch_message_history(self, input_payload):
+        message_notifications, next_cursor = await database_sync_to_async(
+            self.get_message_history
+        )(input_payload.get("cursor"))
+        await sign_msg_notifications(message_notifications)
+        await self.channel_layer.send(
+            self.channel_name,
+            {
+                "type": "message_history",
+                "message_notifications": message_notifications,
+                "next_cursor": next_cursor,
+                "refresh_message_notifications_in": SIGNED_URL_REFRESH_IN,
             },
         )
 
     async def fetch_upload_url(self):
-        filename = str(uuid.uuid4())
-        url = generate_upload_signed_url_v4(filename)
+        filename, url, expires_at = await upload_url_pool.pop()
+        refresh_in = int((expires_at - time.time()) * 1000) - 10000
         await self.channel_layer.send(
             self.channel_name,
             {
                 "type": "upload_url",
                 "upload_url": url,
                 "upload_filename": filename,
-                "refresh_upload_destination_in": 604790000,
+                "refresh_upload_destination_in": refresh_in,
             },
         )
 
@@ -575,20 +1151,31 @@ class RoomConsumer(AsyncJsonWebsocketConsumer):
             room_name, usernames_to_notify = await database_sync_to_async(
                 self.change_room_name
             )(new_room_name)
-            await self.channel_layer.group_send(
+            await send_room_event(
+                self.channel_layer,
                 self.room_id,
                 {"type": "updated_room_name", "room_name": room_name},
             )
-            for username in usernames_to_notify:
-                await self.channel_layer.group_send(
-                    username, {"type": "refresh_notifications"}
+            if usernames_to_notify:
+                await send_user_event(
+                    self.channel_layer,
+                    usernames_to_notify,
+                    {"type": "refresh_notifications", "room": self.room_id},
                 )
 
     async def new_room(self, event):
         # Send message to WebSocket
         await self.send_json(event)
 
+    async def membership_changed(self, event):
+        self.room_allowed = await database_sync_to_async(self.user_allowed)()
+
+    def is_replayed(self, event):
+        return event["seq"] <= self.replayed_seq
+
     async def updated_room_name(self, event):
+        if self.is_replayed(event):
+            return
         # Send message to WebSocket
         await self.send_json(event)
 
@@ -598,13 +1185,16 @@ class RoomConsumer(AsyncJsonWebsocketConsumer):
 
     async def room_notified(self, event):
         await database_sync_to_async(self.read_unread_room_notification)()
-        await self.channel_layer.group_send(
-            self.user.username,
-            {
-                "type": "refresh_notifications",
-            },
+        await send_user_event(
+            self.channel_layer,
+            [self.user.username],
+            {"type": "refresh_notifications", "room": self.room_id},
         )
 
+    async def message_history(self, event):
+        # Send message to WebSocket
+        await self.send_json(event)
+
     async def message_notifications(self, event):
         # Send message to WebSocket
         await self.send_json(event)
@@ -614,8 +1204,17 @@ class RoomConsumer(AsyncJsonWebsocketConsumer):
         await self.send_json(event)
 
     async def new_message(self, event):
-        event = await database_sync_to_async(self.get_new_message_notification_event)(
-            event
-        )
-        if event:
-            await self.send_json(event)
+        if self.is_replayed(event):
+            return
+        if self.user.username not in event["excluded_usernames"]:
+            await self.send_json(
+                {
+                    "type": "new_message",
+                    "message_id": event["message_id"],
+                    "message": dict(
+                        event["message"],
+                        is_own_message=event["creator"] == self.user.username,
+                    ),
+                    "seq": event["seq"],
+                }
+            )
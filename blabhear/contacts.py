@@ -0,0 +1,106 @@
+import asyncio
+import functools
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import phonenumbers
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from phonenumbers.phonenumberutil import NumberParseException
+
+from blabhear.events import send_user_events
+from blabhear.models import Contact
+
+EMPTY_CONTACTS_DIGEST = "0" * 64
+
+
+def create_normalization_executor():
+    if settings.CONTACT_NORMALIZATION_EXECUTOR == "process":
+        return ProcessPoolExecutor(max_workers=settings.CONTACT_NORMALIZATION_WORKERS)
+    return ThreadPoolExecutor(
+        max_workers=settings.CONTACT_NORMALIZATION_WORKERS,
+        thread_name_prefix="contact-normalization",
+    )
+
+
+normalization_executor = create_normalization_executor()
+
+
+@functools.lru_cache(maxsize=settings.CONTACT_NORMALIZATION_CACHE_SIZE)
+def normalize_phone_number(phone_number, alpha2_country_code):
+    try:
+        phone_number = phonenumbers.parse(phone_number, alpha2_country_code)
+    except NumberParseException:
+        return None
+    if phonenumbers.is_valid_number(phone_number):
+        return phonenumbers.format_number(
+            phone_number, phonenumbers.PhoneNumberFormat.E164
+        )
+
+
+def normalize_phone_contacts(phone_contacts, alpha2_country_code):
+    valid_phone_numbers = []
+    for contact in phone_contacts:
+        if contact["phoneNumbers"]:
+            phone_number = next(
+                (
+                    number["number"]
+                    for number in contact["phoneNumbers"]
+                    if number["label"] == "mobile"
+                ),
+                contact["phoneNumbers"][0]["number"],
+            )
+            phone_number = normalize_phone_number(phone_number, alpha2_country_code)
+            if phone_number:
+                valid_phone_numbers.append(phone_number)
+    return valid_phone_numbers
+
+
+async def normalize_phone_contacts_in_chunks(phone_contacts, alpha2_country_code):
+    chunk_size = settings.CONTACT_NORMALIZATION_CHUNK_SIZE
+    loop = asyncio.get_running_loop()
+    for start in range(0, len(phone_contacts), chunk_size):
+        yield await loop.run_in_executor(
+            normalization_executor,
+            normalize_phone_contacts,
+            phone_contacts[start : start + chunk_size],
+            alpha2_country_code,
+        )
+
+
+def update_contacts_digest(contacts_digest, phone_numbers):
+    digest = int(contacts_digest, 16)
+    for phone_number in phone_numbers:
+        digest ^= int(hashlib.sha256(phone_number.encode()).hexdigest(), 16)
+    return f"{digest:064x}"
+
+
+def get_contact_owner_digests(phone_number):
+    return dict(
+        Contact.objects.filter(phone_number=phone_number).values_list(
+            "owner__username", "owner__contacts_digest"
+        )
+    )
+
+
+async def notify_contact_owners(user):
+    owner_digests = await database_sync_to_async(get_contact_owner_digests)(
+        user.phone_number
+    )
+    registered = [
+        {"phone_number": user.phone_number, "display_name": user.display_name}
+    ]
+    await send_user_events(
+        get_channel_layer(),
+        {
+            username: {
+                "type": "contacts_sync",
+                "resync_required": False,
+                "digest": digest,
+                "registered": registered,
+                "unregistered": [],
+            }
+            for username, digest in owner_digests.items()
+        },
+    )
@@ -0,0 +1,127 @@
+import json
+from collections import defaultdict
+
+from django.conf import settings
+
+PUBLISH_SCRIPT = """
+local seq = redis.call('INCR', KEYS[1])
+redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[1], seq .. '-0', 'event', ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+return seq
+"""
+
+REPLAY_SCRIPT = """
+local seq = tonumber(redis.call('GET', KEYS[1]) or '0')
+local last_seq = tonumber(ARGV[1])
+if last_seq > seq then
+    return false
+end
+if last_seq == seq then
+    return {}
+end
+local oldest = redis.call('XRANGE', KEYS[2], '-', '+', 'COUNT', 1)
+if #oldest == 0 or tonumber(string.match(oldest[1][1], '^%d+')) > last_seq + 1 then
+    return false
+end
+local events = {}
+for i, entry in ipairs(redis.call('XRANGE', KEYS[2], (last_seq + 1) .. '-0', '+')) do
+    events[i] = {string.match(entry[1], '^%d+'), entry[2][2]}
+end
+return events
+"""
+
+
+def user_stream(username):
+    return f"user:{username}"
+
+
+def room_stream(room_id):
+    return f"room:{room_id}"
+
+
+def parse_seq(value):
+    try:
+        seq = int(value)
+    except (TypeError, ValueError):
+        return None
+    if seq < 0:
+        return None
+    return seq
+
+
+def stream_keys(channel_layer, stream):
+    return [
+        f"{channel_layer.prefix}:seq:{stream}",
+        f"{channel_layer.prefix}:events:{stream}",
+    ]
+
+
+async def publish_events(channel_layer, stream_events):
+    shard_streams = defaultdict(list)
+    for stream in stream_events:
+        shard_streams[channel_layer.consistent_hash(stream)].append(stream)
+    payloads = {}
+    seqs = {}
+    for index, streams in shard_streams.items():
+        async with channel_layer.connection(index) as connection:
+            pipe = connection.pipeline()
+            for stream in streams:
+                event = stream_events[stream]
+                if id(event) not in payloads:
+                    payloads[id(event)] = json.dumps(event)
+                pipe.eval(
+                    PUBLISH_SCRIPT,
+                    keys=stream_keys(channel_layer, stream),
+                    args=[
+                        settings.EVENT_STREAM_LENGTH,
+                        payloads[id(event)],
+                        settings.EVENT_STREAM_TTL,
+                    ],
+                )
+            seqs.update(zip(streams, await pipe.execute()))
+    return seqs
+
+
+async def get_current_seq(channel_layer, stream):
+    async with channel_layer.connection(
+        channel_layer.consistent_hash(stream)
+    ) as connection:
+        seq = await connection.get(stream_keys(channel_layer, stream)[0])
+    return int(seq or 0)
+
+
+async def replay_events(channel_layer, stream, last_seq):
+    async with channel_layer.connection(
+        channel_layer.consistent_hash(stream)
+    ) as connection:
+        entries = await connection.eval(
+            REPLAY_SCRIPT, keys=stream_keys(channel_layer, stream), args=[last_seq]
+        )
+    if entries is None:
+        return None
+    return [dict(json.loads(payload), seq=int(seq)) for seq, payload in entries]
+
+
+async def send_user_events(channel_layer, user_events):
+    seqs = await publish_events(
+        channel_layer,
+        {user_stream(username): event for username, event in user_events.items()},
+    )
+    await channel_layer.group_send_many(
+        [
+            (username, dict(event, seq=seqs[user_stream(username)]))
+            for username, event in user_events.items()
+        ]
+    )
+
+
+async def send_user_event(channel_layer, usernames, event):
+    await send_user_events(channel_layer, {username: event for username in usernames})
+
+
+async def send_room_event(channel_layer, room_id, event, **live_fields):
+    seqs = await publish_events(channel_layer, {room_stream(room_id): event})
+    await channel_layer.group_send(
+        room_id, dict(event, seq=seqs[room_stream(room_id)], **live_fields)
+    )
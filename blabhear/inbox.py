@@ -0,0 +1,189 @@
+from collections import defaultdict
+
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.db import transaction
+from django.db.models import Count, Exists, F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce, Greatest, Least
+
+from blabhear.models import (
+    HiddenMessage,
+    Message,
+    MessageNotification,
+    User,
+    UserRoomNotification,
+)
+
+INBOX_FIELDS = [
+    "room_display_name",
+    "member_phone_numbers",
+    "last_message_creator_display_name",
+    "is_own_message",
+    "read_seq",
+    "unread_count",
+]
+
+
+def get_inbox_sources(notifications):
+    counterpart_display_name = (
+        User.objects.filter(room=OuterRef("room"))
+        .exclude(id=OuterRef("user"))
+        .values("display_name")[:1]
+    )
+    read_seq = Least("read_seq", "room__message_seq")
+    unread_messages = (
+        Message.objects.filter(room=OuterRef("room"), seq__gt=OuterRef("read_seq"))
+        .filter(
+            ~Q(creator=OuterRef("user")),
+            ~Exists(
+                User.blocked_users.through.objects.filter(
+                    from_user=OuterRef(OuterRef("user")), to_user=OuterRef("creator")
+                )
+            ),
+            ~Exists(
+                HiddenMessage.objects.filter(
+                    user=OuterRef(OuterRef("user")), message=OuterRef("pk")
+                )
+            ),
+        )
+        .filter(
+            Q(room__message_log=True)
+            | Exists(
+                MessageNotification.objects.filter(
+                    receiver=OuterRef(OuterRef("user")), message=OuterRef("pk")
+                )
+            )
+        )
+        .values("room")
+        .annotate(unread_count=Count("id"))
+        .values("unread_count")
+    )
+    return (
+        notifications.annotate(source_read_seq=read_seq)
+        .annotate(
+            source_member_phone_numbers=ArrayAgg(
+                "room__members__phone_number", ordering="room__members__phone_number"
+            ),
+            source_counterpart_display_name=Subquery(counterpart_display_name),
+            source_unread_count=Coalesce(Subquery(unread_messages), 0),
+        )
+        .select_related("room", "message__creator")
+    )
+
+
+def get_expected_inbox_fields(notification):
+    member_phone_numbers = notification.source_member_phone_numbers
+    if len(member_phone_numbers) == 2:
+        room_display_name = notification.source_counterpart_display_name
+    else:
+        room_display_name = notification.room.display_name
+    if notification.message:
+        last_message_creator_display_name = notification.message.creator.display_name
+        is_own_message = notification.message.creator_id == notification.user_id
+    else:
+        last_message_creator_display_name = None
+        is_own_message = False
+    return {
+        "room_display_name": room_display_name,
+        "member_phone_numbers": member_phone_numbers,
+        "last_message_creator_display_name": last_message_creator_display_name,
+        "is_own_message": is_own_message,
+        "read_seq": notification.source_read_seq,
+        "unread_count": notification.source_unread_count,
+    }
+
+
+def find_stale_inbox_entries(notifications=None):
+    if notifications is None:
+        notifications = UserRoomNotification.objects.all()
+    for notification in get_inbox_sources(notifications).iterator():
+        expected = get_expected_inbox_fields(notification)
+        stale_fields = {
+            field: (getattr(notification, field), value)
+            for field, value in expected.items()
+            if sorted_if_list(getattr(notification, field)) != value
+        }
+        if stale_fields:
+            yield notification, stale_fields
+
+
+def rebuild_inbox(notifications=None, batch_size=500):
+    stale_notifications = []
+    unread_count_changes = defaultdict(int)
+    for notification, stale_fields in find_stale_inbox_entries(notifications):
+        for field, (current, expected) in stale_fields.items():
+            setattr(notification, field, expected)
+        if "unread_count" in stale_fields:
+            current, expected = stale_fields["unread_count"]
+            unread_count_changes[notification.user_id] += expected - current
+        notification.version += 1
+        stale_notifications.append(notification)
+    with transaction.atomic():
+        UserRoomNotification.objects.bulk_update(
+            stale_notifications, INBOX_FIELDS + ["version"], batch_size=batch_size
+        )
+        update_unread_counts(unread_count_changes)
+    return len(stale_notifications)
+
+
+def find_stale_unread_totals(users=None):
+    if users is None:
+        users = User.objects.all()
+    unread_count = (
+        UserRoomNotification.objects.filter(user=OuterRef("pk"))
+        .values("user")
+        .annotate(unread_count=Sum("unread_count"))
+        .values("unread_count")
+    )
+    yield from (
+        users.annotate(source_unread_count=Coalesce(Subquery(unread_count), 0))
+        .exclude(unread_count=F("source_unread_count"))
+        .values_list("id", "unread_count", "source_unread_count")
+        .iterator()
+    )
+
+
+def rebuild_unread_totals(users=None):
+    unread_count_changes = {
+        user_id: expected - current
+        for user_id, current, expected in find_stale_unread_totals(users)
+    }
+    with transaction.atomic():
+        update_unread_counts(unread_count_changes)
+    return len(unread_count_changes)
+
+
+def sorted_if_list(value):
+    if isinstance(value, list):
+        return sorted(value)
+    return value
+
+
+def discard_unread_counts(notifications):
+    unread_counts = (
+        notifications.filter(unread_count__gt=0)
+        .values("user")
+        .annotate(unread_count_total=Sum("unread_count"))
+        .values_list("user", "unread_count_total")
+    )
+    update_unread_counts(
+        {user_id: -unread_count for user_id, unread_count in unread_counts}
+    )
+
+
+def update_unread_counts(unread_count_changes):
+    unread_count_changes = {
+        user_id: change for user_id, change in unread_count_changes.items() if change
+    }
+    list(
+        User.objects.select_for_update()
+        .filter(id__in=unread_count_changes)
+        .order_by("id")
+        .values_list("id", flat=True)
+    )
+    user_ids_by_change = defaultdict(list)
+    for user_id, change in unread_count_changes.items():
+        user_ids_by_change[change].append(user_id)
+    for change, user_ids in user_ids_by_change.items():
+        User.objects.filter(id__in=user_ids).update(
+            unread_count=Greatest(F("unread_count") + change, 0)
+        )
@@ -0,0 +1,86 @@
+import logging
+import time
+from collections import defaultdict
+
+from channels_redis.core import RedisChannelLayer
+
+logger = logging.getLogger(__name__)
+
+GROUP_SEND_MANY_SCRIPT = """
+local over_capacity = 0
+local current_time = ARGV[#ARGV - 1]
+local expiry = ARGV[#ARGV]
+for i=1,#KEYS do
+    if redis.call('ZCOUNT', KEYS[i], '-inf', '+inf') < tonumber(ARGV[i + #KEYS]) then
+        redis.call('ZADD', KEYS[i], current_time, ARGV[i])
+        redis.call('EXPIRE', KEYS[i], expiry)
+    else
+        over_capacity = over_capacity + 1
+    end
+end
+return over_capacity
+"""
+
+
+class BulkRedisChannelLayer(RedisChannelLayer):
+    async def group_channels_many(self, groups):
+        shard_groups = defaultdict(list)
+        for group in groups:
+            assert self.valid_group_name(group), "Group name not valid"
+            shard_groups[self.consistent_hash(group)].append(group)
+        group_channels = {}
+        for index, groups in shard_groups.items():
+            async with self.connection(index) as connection:
+                pipe = connection.pipeline()
+                for group in groups:
+                    key = self._group_key(group)
+                    pipe.zremrangebyscore(
+                        key, min=0, max=int(time.time()) - self.group_expiry
+                    )
+                    pipe.zrange(key, 0, -1)
+                results = await pipe.execute()
+            for group, channel_names in zip(groups, results[1::2]):
+                group_channels[group] = [
+                    channel_name.decode("utf8") for channel_name in channel_names
+                ]
+        return group_channels
+
+    async def group_send_many(self, group_messages):
+        group_channels = await self.group_channels_many(
+            {group for group, message in group_messages}
+        )
+        deliveries = defaultdict(list)
+        for group, message in group_messages:
+            (
+                connection_to_channel_keys,
+                channel_keys_to_message,
+                channel_keys_to_capacity,
+            ) = self._map_channel_keys_to_connection(group_channels[group], message)
+            for index, channel_keys in connection_to_channel_keys.items():
+                deliveries[index] += [
+                    (
+                        channel_key,
+                        channel_keys_to_message[channel_key],
+                        channel_keys_to_capacity[channel_key],
+                    )
+                    for channel_key in channel_keys
+                ]
+        for index, shard_deliveries in deliveries.items():
+            channel_keys = [channel_key for channel_key, _, _ in shard_deliveries]
+            args = [message for _, message, _ in shard_deliveries]
+            args += [capacity for _, _, capacity in shard_deliveries]
+            args += [time.time(), self.expiry]
+            async with self.connection(index) as connection:
+                pipe = connection.pipeline()
+                for channel_key in set(channel_keys):
+                    pipe.zremrangebyscore(
+                        channel_key, min=0, max=int(time.time()) - int(self.expiry)
+                    )
+                pipe.eval(GROUP_SEND_MANY_SCRIPT, keys=channel_keys, args=args)
+                results = await pipe.execute()
+            if results[-1] > 0:
+                logger.info(
+                    "%s of %s channel messages over capacity",
+                    results[-1],
+                    len(shard_deliveries),
+                )
@@ -0,0 +1,66 @@
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from blabhear.consumers import RoomConsumer, UserConsumer
+from blabhear.models import Message, Room, User
+
+
+class Command(BaseCommand):
+    help = (
+        "Time message fan-out and reads for per-recipient rows and the room message log"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--members", type=int, nargs="+", default=[2, 10, 100])
+        parser.add_argument("--messages", type=int, default=20)
+
+    def handle(self, *args, **options):
+        for num_members in options["members"]:
+            for message_log in (False, True):
+                send_time, read_time = self.benchmark(
+                    num_members, options["messages"], message_log
+                )
+                strategy = "message log" if message_log else "notifications"
+                self.stdout.write(
+                    f"{num_members} members, {strategy}: "
+                    f"{send_time * 1000 / options['messages']:.2f} ms per send, "
+                    f"{read_time * 1000:.2f} ms per read"
+                )
+
+    def benchmark(self, num_members, num_messages, message_log):
+        with transaction.atomic():
+            members = [
+                User.objects.create(
+                    username=f"benchmark-{uuid.uuid4()}",
+                    phone_number=f"benchmark-{uuid.uuid4()}",
+                    alpha2_country_code="GB",
+                    display_name="Benchmark",
+                )
+                for _ in range(num_members)
+            ]
+            room_consumer = RoomConsumer()
+            room_consumer.user = members[0]
+            room = room_consumer.create_room(members, None)
+            Room.objects.filter(id=room.id).update(
+                message_log=message_log, message_log_backfilled=message_log
+            )
+            room_consumer.room_id = str(room.id)
+            started_at = time.perf_counter()
+            for _ in range(num_messages):
+                message = Message.objects.create(room_id=room.id, creator=members[0])
+                room_consumer.fan_out_new_message(message)
+            send_time = time.perf_counter() - started_at
+            reader_room_consumer = RoomConsumer()
+            reader_room_consumer.user = members[-1]
+            reader_room_consumer.room_id = str(room.id)
+            reader_user_consumer = UserConsumer()
+            reader_user_consumer.user = members[-1]
+            started_at = time.perf_counter()
+            reader_room_consumer.get_message_history(None)
+            reader_user_consumer.get_notifications()
+            read_time = time.perf_counter() - started_at
+            transaction.set_rollback(True)
+        return send_time, read_time
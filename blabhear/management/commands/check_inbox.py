@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from blabhear.inbox import find_stale_inbox_entries, find_stale_unread_totals
+
+
+class Command(BaseCommand):
+    help = "Report inbox entries whose denormalized columns disagree with the source tables"
+
+    def handle(self, *args, **options):
+        stale = 0
+        for notification, stale_fields in find_stale_inbox_entries():
+            stale += 1
+            for field, (current, expected) in stale_fields.items():
+                self.stdout.write(
+                    f"{notification.id} {field}: {current!r} != {expected!r}"
+                )
+        for user_id, current, expected in find_stale_unread_totals():
+            stale += 1
+            self.stdout.write(
+                f"user {user_id} unread_count: {current!r} != {expected!r}"
+            )
+        if stale:
+            raise CommandError(f"{stale} stale inbox entries")
+        self.stdout.write("Inbox is consistent")
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from blabhear.inbox import rebuild_inbox, rebuild_unread_totals
+
+
+class Command(BaseCommand):
+    help = "Rebuild the denormalized inbox columns from rooms, members and messages"
+
+    def handle(self, *args, **options):
+        rebuilt = rebuild_inbox()
+        self.stdout.write(f"Rebuilt {rebuilt} inbox entries")
+        rebuilt = rebuild_unread_totals()
+        self.stdout.write(f"Rebuilt {rebuilt} unread totals")
@@ -0,0 +1,43 @@
+import threading
+from collections import defaultdict
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = defaultdict(int)
+        self.gauges = defaultdict(int)
+        self.timings = defaultdict(lambda: {"count": 0, "total": 0.0, "max": 0.0})
+
+    def increment(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def adjust_gauge(self, name, value):
+        with self.lock:
+            self.gauges[name] += value
+
+    def observe(self, name, seconds):
+        with self.lock:
+            timing = self.timings[name]
+            timing["count"] += 1
+            timing["total"] += seconds
+            timing["max"] = max(timing["max"], seconds)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "timings": {
+                    name: {
+                        "count": timing["count"],
+                        "mean": timing["total"] / timing["count"],
+                        "max": timing["max"],
+                    }
+                    for name, timing in self.timings.items()
+                },
+            }
+
+
+metrics = Metrics()
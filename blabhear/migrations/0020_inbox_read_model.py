@@ -0,0 +1,84 @@
+# Generated by Django 3.2.18 on 2026-10-17 02:03
+
+import django.contrib.postgres.fields
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def populate_inbox(apps, schema_editor):
+    User = apps.get_model("blabhear", "User")
+    UserRoomNotification = apps.get_model("blabhear", "UserRoomNotification")
+    counterpart_display_name = (
+        User.objects.filter(room=OuterRef("room"))
+        .exclude(id=OuterRef("user"))
+        .values("display_name")[:1]
+    )
+    notifications = UserRoomNotification.objects.annotate(
+        source_member_phone_numbers=ArrayAgg(
+            "room__members__phone_number", ordering="room__members__phone_number"
+        ),
+        source_counterpart_display_name=Subquery(counterpart_display_name),
+    ).select_related("room", "message__creator")
+    updated_notifications = []
+    for notification in notifications.iterator():
+        notification.member_phone_numbers = notification.source_member_phone_numbers
+        if len(notification.member_phone_numbers) == 2:
+            notification.room_display_name = (
+                notification.source_counterpart_display_name
+            )
+        else:
+            notification.room_display_name = notification.room.display_name
+        if notification.message:
+            notification.last_message_creator_display_name = (
+                notification.message.creator.display_name
+            )
+            notification.is_own_message = (
+                notification.message.creator_id == notification.user_id
+            )
+        updated_notifications.append(notification)
+    UserRoomNotification.objects.bulk_update(
+        updated_notifications,
+        [
+            "room_display_name",
+            "member_phone_numbers",
+            "last_message_creator_display_name",
+            "is_own_message",
+        ],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blabhear', '0019_user_fcm_registration_token'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userroomnotification',
+            name='is_own_message',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='userroomnotification',
+            name='last_message_creator_display_name',
+            field=models.CharField(blank=True, max_length=150, null=True),
+        ),
+        migrations.AddField(
+            model_name='userroomnotification',
+            name='member_phone_numbers',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=150), blank=True, default=list, size=None),
+        ),
+        migrations.AddField(
+            model_name='userroomnotification',
+            name='room_display_name',
+            field=models.CharField(blank=True, max_length=150),
+        ),
+        migrations.AddIndex(
+            model_name='userroomnotification',
+            index=models.Index(fields=['user', 'read', '-timestamp'], name='inbox_idx'),
+        ),
+        migrations.RunPython(populate_inbox, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.18 on 2026-10-17 02:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blabhear', '0020_inbox_read_model'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userroomnotification',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 3.2.18 on 2026-10-17 02:12
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def populate_member_keys(apps, schema_editor):
+    Room = apps.get_model("blabhear", "Room")
+    member_keys = set()
+    for room in Room.objects.prefetch_related("members").order_by("id"):
+        member_key = hashlib.sha256(
+            ",".join(sorted(str(member.id) for member in room.members.all())).encode()
+        ).hexdigest()
+        if member_key in member_keys:
+            room.delete()
+        else:
+            member_keys.add(member_key)
+            room.member_key = member_key
+            room.save(update_fields=["member_key"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blabhear', '0021_userroomnotification_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='member_key',
+            field=models.CharField(max_length=64, null=True, unique=True),
+        ),
+        migrations.RunPython(populate_member_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.18 on 2026-10-17 02:14
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blabhear', '0022_room_member_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='contacts_digest',
+            field=models.CharField(default='0000000000000000000000000000000000000000000000000000000000000000', max_length=64),
+        ),
+        migrations.CreateModel(
+            name='Contact',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('phone_number', models.CharField(max_length=150)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='contacts', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='contact',
+            constraint=models.UniqueConstraint(fields=('owner', 'phone_number'), name='unique_contact'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.18 on 2026-10-17 02:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blabhear', '0023_contact'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='contact',
+            name='phone_number',
+            field=models.CharField(db_index=True, max_length=150),
+        ),
+    ]
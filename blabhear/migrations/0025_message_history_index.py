@@ -0,0 +1,17 @@
+# Generated by Django 3.2.18 on 2026-10-17 02:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blabhear', '0024_contact_phone_number_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='messagenotification',
+            index=models.Index(fields=['receiver', 'room', '-timestamp', '-id'], name='message_history_idx'),
+        ),
+    ]
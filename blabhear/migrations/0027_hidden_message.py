@@ -0,0 +1,28 @@
+# Generated by Django 3.2.18 on 2026-10-17 02:19
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blabhear', '0026_room_message_log'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HiddenMessage',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('message', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='blabhear.message')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='hiddenmessage',
+            constraint=models.UniqueConstraint(fields=('user', 'message'), name='unique_hidden_message'),
+        ),
+    ]
@@ -0,0 +1,110 @@
+# Generated by Django 3.2.18 on 2026-10-17 02:20
+
+from django.db import migrations, models, transaction
+from django.db.models import Count
+
+BATCH_SIZE = 1000
+
+MESSAGE_LOG_MEMBER_THRESHOLD = 50
+
+NUMBER_MESSAGES_SQL = """
+UPDATE {message} message SET seq = numbered.seq
+FROM (
+    SELECT id, %s + row_number() OVER (ORDER BY created_at, id) AS seq
+    FROM {message}
+    WHERE room_id = %s AND seq IS NULL
+) numbered
+WHERE message.id = numbered.id
+"""
+
+HIDE_UNNOTIFIED_MESSAGES_SQL = """
+INSERT INTO {hidden_message} (id, user_id, message_id)
+SELECT md5(member.user_id::text || message.id::text)::uuid, member.user_id, message.id
+FROM {message} message
+JOIN {room_members} member ON member.room_id = message.room_id
+WHERE message.id = ANY(%s::uuid[])
+AND NOT EXISTS (
+    SELECT 1 FROM {message_notification} notification
+    WHERE notification.message_id = message.id
+    AND notification.receiver_id = member.user_id
+)
+ON CONFLICT DO NOTHING
+"""
+
+
+def backfill_message_log(apps, schema_editor):
+    Room = apps.get_model("blabhear", "Room")
+    Message = apps.get_model("blabhear", "Message")
+    MessageNotification = apps.get_model("blabhear", "MessageNotification")
+    HiddenMessage = apps.get_model("blabhear", "HiddenMessage")
+    sql = HIDE_UNNOTIFIED_MESSAGES_SQL.format(
+        hidden_message=HiddenMessage._meta.db_table,
+        message=Message._meta.db_table,
+        room_members=Room.members.through._meta.db_table,
+        message_notification=MessageNotification._meta.db_table,
+    )
+    Room.objects.filter(message_log=True).update(message_log_backfilled=True)
+    rooms = Room.objects.annotate(num_members=Count("members")).filter(
+        message_log=False, num_members__gt=MESSAGE_LOG_MEMBER_THRESHOLD
+    )
+    Room.objects.filter(id__in=rooms.values("id")).update(message_log=True)
+    room_ids = Room.objects.filter(
+        message_log=True, message_log_backfilled=False
+    ).values_list("id", flat=True)
+    for room_id in list(room_ids):
+        messages = Message.objects.filter(room_id=room_id, seq__isnull=True)
+        for batch in iterate_in_batches(messages):
+            with transaction.atomic(), schema_editor.connection.cursor() as cursor:
+                cursor.execute(sql, [batch])
+        Room.objects.filter(id=room_id).update(message_log_backfilled=True)
+        notifications = MessageNotification.objects.filter(room_id=room_id)
+        for batch in iterate_in_batches(notifications):
+            MessageNotification.objects.filter(id__in=batch).delete()
+
+
+def number_messages(apps, schema_editor):
+    Room = apps.get_model("blabhear", "Room")
+    Message = apps.get_model("blabhear", "Message")
+    sql = NUMBER_MESSAGES_SQL.format(message=Message._meta.db_table)
+    for batch in iterate_in_batches(Room.objects.all()):
+        for room_id in batch:
+            with transaction.atomic():
+                room = Room.objects.select_for_update().get(id=room_id)
+                with schema_editor.connection.cursor() as cursor:
+                    cursor.execute(sql, [room.message_seq, room_id])
+                    numbered = cursor.rowcount
+                if numbered:
+                    room.message_seq += numbered
+                    room.save(update_fields=["message_seq"])
+
+
+def iterate_in_batches(queryset):
+    last_id = None
+    while True:
+        batch = queryset.order_by("id")
+        if last_id:
+            batch = batch.filter(id__gt=last_id)
+        batch = list(batch.values_list("id", flat=True)[:BATCH_SIZE])
+        if not batch:
+            return
+        yield batch
+        last_id = batch[-1]
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('blabhear', '0027_hidden_message'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='message_log_backfilled',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(backfill_message_log, migrations.RunPython.noop),
+        migrations.RunPython(number_messages, migrations.RunPython.noop),
+    ]
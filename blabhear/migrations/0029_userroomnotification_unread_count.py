@@ -0,0 +1,75 @@
+# Generated by Django 3.2.18 on 2026-10-17 02:20
+
+from django.db import migrations, models
+from django.db.models import Count, Exists, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+
+def populate_unread_counts(apps, schema_editor):
+    Room = apps.get_model("blabhear", "Room")
+    User = apps.get_model("blabhear", "User")
+    Message = apps.get_model("blabhear", "Message")
+    MessageNotification = apps.get_model("blabhear", "MessageNotification")
+    HiddenMessage = apps.get_model("blabhear", "HiddenMessage")
+    UserRoomNotification = apps.get_model("blabhear", "UserRoomNotification")
+    message_seq = Room.objects.filter(id=OuterRef("room")).values("message_seq")
+    UserRoomNotification.objects.filter(read=True).update(
+        read_seq=Subquery(message_seq)
+    )
+    own_message_seq = (
+        Message.objects.filter(
+            room=OuterRef("room"), creator=OuterRef("user"), seq__isnull=False
+        )
+        .order_by("-seq")
+        .values("seq")[:1]
+    )
+    UserRoomNotification.objects.filter(read=False).update(
+        read_seq=Greatest("read_seq", Coalesce(Subquery(own_message_seq), 0))
+    )
+    unread_messages = (
+        Message.objects.filter(room=OuterRef("room"), seq__gt=OuterRef("read_seq"))
+        .filter(
+            ~Q(creator=OuterRef("user")),
+            ~Exists(
+                User.blocked_users.through.objects.filter(
+                    from_user=OuterRef(OuterRef("user")), to_user=OuterRef("creator")
+                )
+            ),
+            ~Exists(
+                HiddenMessage.objects.filter(
+                    user=OuterRef(OuterRef("user")), message=OuterRef("pk")
+                )
+            ),
+        )
+        .filter(
+            Q(room__message_log=True)
+            | Exists(
+                MessageNotification.objects.filter(
+                    receiver=OuterRef(OuterRef("user")), message=OuterRef("pk")
+                )
+            )
+        )
+        .values("room")
+        .annotate(unread_count=Count("id"))
+        .values("unread_count")
+    )
+    UserRoomNotification.objects.filter(read=False).update(
+        unread_count=Coalesce(Subquery(unread_messages), 0),
+        version=F("version") + 1,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blabhear', '0028_convert_rooms_to_message_log'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userroomnotification',
+            name='unread_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_unread_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.2.18 on 2026-10-17 02:37
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blabhear', '0029_userroomnotification_unread_count'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='room',
+            name='last_message',
+        ),
+        migrations.RemoveField(
+            model_name='room',
+            name='last_message_at',
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.18 on 2026-10-17 02:42
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def populate_unread_counts(apps, schema_editor):
+    User = apps.get_model("blabhear", "User")
+    UserRoomNotification = apps.get_model("blabhear", "UserRoomNotification")
+    unread_count = (
+        UserRoomNotification.objects.filter(user=OuterRef("pk"))
+        .values("user")
+        .annotate(unread_count=Sum("unread_count"))
+        .values("unread_count")
+    )
+    User.objects.update(unread_count=Coalesce(Subquery(unread_count), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blabhear', '0030_remove_room_last_message'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='unread_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_unread_counts, migrations.RunPython.noop),
+    ]
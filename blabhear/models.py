@@ -1,6 +1,7 @@
 import uuid
 
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.fields import ArrayField
 from django.db import models
 from django.db.models import Q, F
 
@@ -12,12 +13,31 @@ class User(AbstractUser):
     display_name = models.CharField(max_length=150)
     blocked_users = models.ManyToManyField("self", blank=True)
     fcm_registration_token = models.TextField(unique=True, null=True, blank=True)
+    contacts_digest = models.CharField(max_length=64, default="0" * 64)
+    unread_count = models.PositiveIntegerField(default=0)
+
+
+class Contact(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name="contacts")
+    phone_number = models.CharField(max_length=150, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["owner", "phone_number"], name="unique_contact"
+            ),
+        ]
 
 
 class Room(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     members = models.ManyToManyField(User)
     display_name = models.CharField(max_length=150, blank=True)
+    member_key = models.CharField(max_length=64, unique=True, null=True)
+    message_log = models.BooleanField(default=False)
+    message_log_backfilled = models.BooleanField(default=False)
+    message_seq = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return str(self.id)
@@ -29,6 +49,12 @@ class Message(models.Model):
     room = models.ForeignKey(Room, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    seq = models.PositiveIntegerField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["room", "-created_at", "-id"], name="message_log_idx"),
+        ]
 
     def __str__(self):
         return str(self.id)
@@ -43,6 +69,17 @@ class UserRoomNotification(models.Model):
     message = models.ForeignKey(
         Message, blank=True, null=True, on_delete=models.SET_NULL
     )
+    room_display_name = models.CharField(max_length=150, blank=True)
+    member_phone_numbers = ArrayField(
+        models.CharField(max_length=150), blank=True, default=list
+    )
+    last_message_creator_display_name = models.CharField(
+        max_length=150, blank=True, null=True
+    )
+    is_own_message = models.BooleanField(default=False)
+    version = models.PositiveIntegerField(default=0)
+    read_seq = models.PositiveIntegerField(default=0)
+    unread_count = models.PositiveIntegerField(default=0)
 
     class Meta:
         constraints = [
@@ -50,6 +87,9 @@ class UserRoomNotification(models.Model):
                 fields=["room", "user"], name="unique_notification"
             ),
         ]
+        indexes = [
+            models.Index(fields=["user", "read", "-timestamp"], name="inbox_idx"),
+        ]
 
 
 class MessageNotification(models.Model):
@@ -65,6 +105,25 @@ class MessageNotification(models.Model):
                 fields=["room", "receiver", "message"], name="unique_msg_notification"
             ),
         ]
+        indexes = [
+            models.Index(
+                fields=["receiver", "room", "-timestamp", "-id"],
+                name="message_history_idx",
+            ),
+        ]
+
+
+class HiddenMessage(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    message = models.ForeignKey(Message, on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "message"], name="unique_hidden_message"
+            ),
+        ]
 
 
 class Report(models.Model):
@@ -0,0 +1,37 @@
+import time
+
+from django.conf import settings
+
+
+def presence_key(channel_layer, room_id):
+    return f"{channel_layer.prefix}:presence:{room_id}"
+
+
+async def mark_present(channel_layer, room_id, username, channel_name):
+    key = presence_key(channel_layer, room_id)
+    now = time.time()
+    async with channel_layer.connection(
+        channel_layer.consistent_hash(room_id)
+    ) as connection:
+        pipe = connection.pipeline()
+        pipe.zremrangebyscore(key, max=now)
+        pipe.zadd(key, now + settings.PRESENCE_TTL, f"{username}:{channel_name}")
+        pipe.expire(key, int(settings.PRESENCE_TTL))
+        await pipe.execute()
+
+
+async def mark_absent(channel_layer, room_id, username, channel_name):
+    key = presence_key(channel_layer, room_id)
+    async with channel_layer.connection(
+        channel_layer.consistent_hash(room_id)
+    ) as connection:
+        await connection.zrem(key, f"{username}:{channel_name}")
+
+
+async def get_present_usernames(channel_layer, room_id):
+    key = presence_key(channel_layer, room_id)
+    async with channel_layer.connection(
+        channel_layer.consistent_hash(room_id)
+    ) as connection:
+        members = await connection.zrangebyscore(key, min=time.time(), encoding="utf-8")
+    return {member.split(":", 1)[0] for member in members}
@@ -0,0 +1,176 @@
+import asyncio
+import logging
+
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from django.conf import settings
+from firebase_admin import exceptions, messaging
+
+from blabhear.models import User
+
+logger = logging.getLogger(__name__)
+
+MAX_MULTICAST_TOKENS = 500
+TRANSIENT_ERRORS = (
+    exceptions.DeadlineExceededError,
+    exceptions.InternalError,
+    exceptions.ResourceExhaustedError,
+    exceptions.UnavailableError,
+)
+
+
+def clear_registration_tokens(registration_tokens):
+    User.objects.filter(fcm_registration_token__in=registration_tokens).update(
+        fcm_registration_token=None
+    )
+
+
+def describe_creators(creator_display_names):
+    names = list(dict.fromkeys(creator_display_names))
+    if len(names) > 1:
+        names = f"{', '.join(names[:-1])} and {names[-1]}"
+    else:
+        names = names[0]
+    if len(creator_display_names) > 1:
+        return f"{names} spoke {len(creator_display_names)} times"
+    return f"{names} spoke"
+
+
+class PushDispatcher:
+    def __init__(self, send_multicast=messaging.send_multicast):
+        self.send_multicast = send_multicast
+        self.queue = None
+        self.workers = []
+        self.pending = {}
+
+    def enqueue(self, room_id, room_display_name, creator_display_name, badges):
+        badges = {token: badge for token, badge in badges.items() if token}
+        if not badges:
+            return
+        self.start()
+        coalescing = room_id in self.pending
+        if not coalescing:
+            self.pending[room_id] = {
+                "room_display_name": None,
+                "tokens": {},
+                "badges": {},
+            }
+        pending = self.pending[room_id]
+        pending["room_display_name"] = room_display_name
+        for token, badge in badges.items():
+            pending["tokens"].setdefault(token, []).append(creator_display_name)
+            pending["badges"][token] = badge
+        if not coalescing:
+            self.flush(room_id)
+
+    def flush(self, room_id):
+        pending = self.pending.pop(room_id)
+        if not pending["tokens"]:
+            return
+        pushes = {}
+        for token, creator_display_names in pending["tokens"].items():
+            description = describe_creators(creator_display_names)
+            if pending["room_display_name"] is None:
+                title, body = description, None
+            else:
+                title, body = pending["room_display_name"], description
+            badge = pending["badges"][token]
+            pushes.setdefault((title, body, badge), []).append(token)
+        for (title, body, badge), registration_tokens in pushes.items():
+            self.queue.put_nowait((registration_tokens, title, body, badge, room_id))
+        self.pending[room_id] = {
+            "room_display_name": pending["room_display_name"],
+            "tokens": {},
+            "badges": {},
+        }
+        asyncio.get_running_loop().call_later(
+            settings.PUSH_NOTIFICATION_COALESCE_WINDOW, self.flush, room_id
+        )
+
+    def start(self):
+        if self.queue is None:
+            self.queue = asyncio.Queue()
+        self.workers = [worker for worker in self.workers if not worker.done()]
+        while len(self.workers) < settings.PUSH_NOTIFICATION_WORKERS:
+            self.workers.append(asyncio.create_task(self.run()))
+
+    async def run(self):
+        while True:
+            (
+                registration_tokens,
+                title,
+                body,
+                badge,
+                collapse_key,
+            ) = await self.queue.get()
+            try:
+                await self.deliver(
+                    registration_tokens, title, body, badge, collapse_key
+                )
+            except Exception:
+                logger.exception("Failed to deliver push notification")
+            finally:
+                self.queue.task_done()
+
+    async def deliver(self, registration_tokens, title, body, badge, collapse_key):
+        unregistered_tokens = []
+        for start in range(0, len(registration_tokens), MAX_MULTICAST_TOKENS):
+            batch = registration_tokens[start : start + MAX_MULTICAST_TOKENS]
+            unregistered_tokens += await self.send_batch(
+                batch, title, body, badge, collapse_key
+            )
+        if unregistered_tokens:
+            await database_sync_to_async(clear_registration_tokens)(unregistered_tokens)
+
+    async def send_batch(self, registration_tokens, title, body, badge, collapse_key):
+        unregistered_tokens = []
+        for attempt in range(settings.PUSH_NOTIFICATION_MAX_ATTEMPTS):
+            if attempt:
+                await asyncio.sleep(
+                    settings.PUSH_NOTIFICATION_RETRY_BACKOFF * 2 ** (attempt - 1)
+                )
+            push_message = messaging.MulticastMessage(
+                tokens=registration_tokens,
+                notification=messaging.Notification(title=title, body=body, image=None),
+                android=messaging.AndroidConfig(
+                    priority="high",
+                    collapse_key=collapse_key,
+                    notification=messaging.AndroidNotification(
+                        priority="max", tag=collapse_key, notification_count=badge
+                    ),
+                ),
+                apns=messaging.APNSConfig(
+                    headers={"apns-collapse-id": collapse_key},
+                    payload=messaging.APNSPayload(aps=messaging.Aps(badge=badge)),
+                ),
+            )
+            try:
+                response = await sync_to_async(
+                    self.send_multicast, thread_sensitive=False
+                )(push_message)
+            except TRANSIENT_ERRORS as exc:
+                logger.warning("Retrying push notification batch: %s", exc)
+                continue
+            failed_tokens = []
+            for token, send_response in zip(registration_tokens, response.responses):
+                if send_response.success:
+                    continue
+                if isinstance(send_response.exception, messaging.UnregisteredError):
+                    unregistered_tokens.append(token)
+                elif isinstance(send_response.exception, TRANSIENT_ERRORS):
+                    failed_tokens.append(token)
+                else:
+                    logger.warning(
+                        "Push notification rejected: %s", send_response.exception
+                    )
+            registration_tokens = failed_tokens
+            if not registration_tokens:
+                break
+        else:
+            logger.error(
+                "Gave up on push notification to %s devices", len(registration_tokens)
+            )
+        return unregistered_tokens
+
+
+push_dispatcher = PushDispatcher()
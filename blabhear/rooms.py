@@ -0,0 +1,26 @@
+import hashlib
+
+from django.db import transaction
+
+from blabhear.inbox import discard_unread_counts
+from blabhear.models import Room
+
+
+def get_member_key(member_ids):
+    return hashlib.sha256(
+        ",".join(sorted(str(member_id) for member_id in member_ids)).encode()
+    ).hexdigest()
+
+
+def refresh_member_keys(rooms):
+    for room in rooms.prefetch_related("members"):
+        member_key = get_member_key(member.id for member in room.members.all())
+        if member_key == room.member_key:
+            continue
+        with transaction.atomic():
+            if Room.objects.filter(member_key=member_key).exists():
+                discard_unread_counts(room.userroomnotification_set.all())
+                room.delete()
+            else:
+                room.member_key = member_key
+                room.save(update_fields=["member_key"])
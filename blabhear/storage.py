@@ -1,10 +1,21 @@
+import asyncio
 import datetime
+import functools
+import math
 import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
+from django.conf import settings
+from django.core.cache import cache
 from google.cloud import storage
 from google.oauth2 import service_account
 
 from blabhear.exceptions import InvalidArgumentError
+from blabhear.metrics import metrics
 
 gcp_storage_credentials = {
     "type": "service_account",
@@ -25,28 +36,168 @@ credentials = service_account.Credentials.from_service_account_info(
 storage_client = storage.Client(
     project=gcp_storage_credentials["project_id"], credentials=credentials
 )
+bucket = storage_client.bucket(os.environ.get("GCP_BUCKET_NAME"))
 
+SIGNED_URL_EXPIRATION = datetime.timedelta(days=7)
+SIGNED_URL_REFRESH_IN = int(settings.SIGNED_URL_REUSE_MARGIN * 1000) - 10000
 
-def generate_upload_signed_url_v4(blob_name):
-    bucket = storage_client.bucket(os.environ.get("GCP_BUCKET_NAME"))
-    blob = bucket.blob(blob_name)
 
-    url = blob.generate_signed_url(
-        version="v4",
-        expiration=datetime.timedelta(days=7),
-        method="PUT",
-        content_type="audio/mp4",
+class SignedUrlCache:
+    def __init__(self):
+        self.urls = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, blob_name, method):
+        key = (blob_name, method)
+        with self.lock:
+            if key in self.urls:
+                url, reusable_until = self.urls[key]
+                if reusable_until > time.time():
+                    self.urls.move_to_end(key)
+                    return url
+                del self.urls[key]
+
+    def set(self, blob_name, method, url, reusable_until):
+        key = (blob_name, method)
+        with self.lock:
+            self.urls[key] = (url, reusable_until)
+            self.urls.move_to_end(key)
+            while len(self.urls) > settings.SIGNED_URL_CACHE_SIZE:
+                self.urls.popitem(last=False)
+
+
+signed_url_cache = SignedUrlCache()
+
+
+def create_signing_executor():
+    if settings.URL_SIGNING_EXECUTOR == "process":
+        return ProcessPoolExecutor(max_workers=settings.URL_SIGNING_WORKERS)
+    return ThreadPoolExecutor(
+        max_workers=settings.URL_SIGNING_WORKERS, thread_name_prefix="url-signing"
     )
-    return url
 
 
-def generate_download_signed_url_v4(blob_name):
-    bucket = storage_client.bucket(os.environ.get("GCP_BUCKET_NAME"))
-    blob = bucket.blob(blob_name)
+signing_executor = create_signing_executor()
 
+
+def sign_blob_url(blob_name, method, **kwargs):
+    expires_at = time.time() + SIGNED_URL_EXPIRATION.total_seconds()
+    blob = bucket.blob(blob_name)
     url = blob.generate_signed_url(
         version="v4",
-        expiration=datetime.timedelta(days=7),
-        method="GET",
+        expiration=SIGNED_URL_EXPIRATION,
+        method=method,
+        **kwargs,
     )
+    return url, expires_at
+
+
+def sign_url(blob_name, method, **kwargs):
+    shared_key = f"signed_url:{method}:{blob_name}"
+    if settings.SIGNED_URL_SHARED_CACHE:
+        entry = cache.get(shared_key)
+        if entry:
+            return entry
+    url, expires_at = sign_blob_url(blob_name, method, **kwargs)
+    entry = (url, expires_at - settings.SIGNED_URL_REUSE_MARGIN)
+    if settings.SIGNED_URL_SHARED_CACHE:
+        cache.set(shared_key, entry, timeout=entry[1] - time.time())
+    return entry
+
+
+async def run_signing(func, *args, **kwargs):
+    started_at = time.monotonic()
+    metrics.adjust_gauge("url_signing.queue_depth", 1)
+    try:
+        return await asyncio.get_running_loop().run_in_executor(
+            signing_executor, functools.partial(func, *args, **kwargs)
+        )
+    finally:
+        metrics.adjust_gauge("url_signing.queue_depth", -1)
+        metrics.observe("url_signing.latency", time.monotonic() - started_at)
+
+
+async def generate_signed_url_v4(blob_name, method, **kwargs):
+    url = signed_url_cache.get(blob_name, method)
+    if url is None:
+        url, reusable_until = await run_signing(sign_url, blob_name, method, **kwargs)
+        signed_url_cache.set(blob_name, method, url, reusable_until)
     return url
+
+
+async def generate_upload_signed_url_v4(blob_name):
+    return await run_signing(sign_blob_url, blob_name, "PUT", content_type="audio/mp4")
+
+
+async def generate_download_signed_url_v4(blob_name):
+    return await generate_signed_url_v4(blob_name, "GET")
+
+
+async def generate_download_signed_urls_v4(blob_names):
+    return await asyncio.gather(
+        *(generate_download_signed_url_v4(blob_name) for blob_name in blob_names)
+    )
+
+
+class UploadUrlPool:
+    def __init__(self):
+        self.uploads = deque()
+        self.handed_out_at = deque()
+        self.refill_task = None
+
+    async def pop(self):
+        now = time.time()
+        self.handed_out_at.append(now)
+        while self.handed_out_at[0] < now - settings.UPLOAD_URL_POOL_RATE_WINDOW:
+            self.handed_out_at.popleft()
+        upload = None
+        while self.uploads:
+            upload = self.uploads.popleft()
+            if upload[2] - settings.SIGNED_URL_REUSE_MARGIN > now:
+                break
+            upload = None
+        if len(self.uploads) < self.high_watermark() // 2:
+            self.start_refill()
+        if upload is None:
+            metrics.increment("upload_url_pool.misses")
+            filename = str(uuid.uuid4())
+            upload = (filename, *await generate_upload_signed_url_v4(filename))
+        else:
+            metrics.increment("upload_url_pool.hits")
+        return upload
+
+    def high_watermark(self):
+        send_rate = len(self.handed_out_at) / settings.UPLOAD_URL_POOL_RATE_WINDOW
+        return min(
+            max(
+                settings.UPLOAD_URL_POOL_MIN_SIZE,
+                math.ceil(send_rate * settings.UPLOAD_URL_POOL_HORIZON),
+            ),
+            settings.UPLOAD_URL_POOL_MAX_SIZE,
+        )
+
+    def start_refill(self):
+        if self.refill_task is None or self.refill_task.done():
+            self.refill_task = asyncio.create_task(self.refill())
+
+    async def refill(self):
+        while len(self.uploads) < self.high_watermark():
+            filenames = [
+                str(uuid.uuid4())
+                for _ in range(
+                    min(
+                        self.high_watermark() - len(self.uploads),
+                        settings.URL_SIGNING_WORKERS,
+                    )
+                )
+            ]
+            signed_urls = await asyncio.gather(
+                *(generate_upload_signed_url_v4(filename) for filename in filenames)
+            )
+            self.uploads.extend(
+                (filename, url, expires_at)
+                for filename, (url, expires_at) in zip(filenames, signed_urls)
+            )
+
+
+upload_url_pool = UploadUrlPool()
@@ -0,0 +1,112 @@
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+
+from blabhear.consumers import UserConsumer
+from blabhear.contacts import (
+    EMPTY_CONTACTS_DIGEST,
+    notify_contact_owners,
+    update_contacts_digest,
+)
+from blabhear.events import get_current_seq, user_stream
+from blabhear.models import Contact
+from blabhear.tests.utils import ChannelLayerTestCase, create_user
+
+
+class NotifyContactOwnersTests(ChannelLayerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = create_user("Owner")
+        self.new_user = create_user("Newcomer")
+        Contact.objects.create(
+            owner=self.owner, phone_number=self.new_user.phone_number
+        )
+        self.owner.contacts_digest = update_contacts_digest(
+            self.owner.contacts_digest, [self.new_user.phone_number]
+        )
+        self.owner.save()
+
+    async def connect(self, query_string=""):
+        communicator = WebsocketCommunicator(
+            UserConsumer.as_asgi(), f"/ws/user/{self.owner.username}/?{query_string}"
+        )
+        communicator.scope["url_route"] = {"kwargs": {"user_id": self.owner.username}}
+        communicator.scope["user"] = self.owner
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    def assert_contacts_sync(self, event, seq):
+        self.assertEqual(
+            event,
+            {
+                "type": "contacts_sync",
+                "resync_required": False,
+                "digest": self.owner.contacts_digest,
+                "registered": [
+                    {
+                        "phone_number": self.new_user.phone_number,
+                        "display_name": "Newcomer",
+                    }
+                ],
+                "unregistered": [],
+                "seq": seq,
+            },
+        )
+
+    async def test_owners_receive_contacts_sync_with_their_digest(self):
+        communicator = await self.connect()
+        await communicator.receive_json_from()
+        await communicator.receive_json_from()
+        await notify_contact_owners(self.new_user)
+        seq = await get_current_seq(
+            self.channel_layer, user_stream(self.owner.username)
+        )
+        self.assert_contacts_sync(await communicator.receive_json_from(), seq)
+        await communicator.disconnect()
+
+    async def test_contacts_sync_is_replayed_on_resume(self):
+        last_seq = await get_current_seq(
+            self.channel_layer, user_stream(self.owner.username)
+        )
+        await notify_contact_owners(self.new_user)
+        communicator = await self.connect(f"last_seq={last_seq}")
+        self.assert_contacts_sync(await communicator.receive_json_from(), last_seq + 1)
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+
+class FetchRegisteredContactsTests(ChannelLayerTestCase):
+    async def test_full_upload_returns_the_new_digest(self):
+        owner = await database_sync_to_async(create_user)("Owner")
+        friend = await database_sync_to_async(create_user)("Friend")
+        communicator = WebsocketCommunicator(
+            UserConsumer.as_asgi(), f"/ws/user/{owner.username}/"
+        )
+        communicator.scope["url_route"] = {"kwargs": {"user_id": owner.username}}
+        communicator.scope["user"] = owner
+        await communicator.connect()
+        await communicator.receive_json_from()
+        await communicator.receive_json_from()
+        await communicator.send_json_to(
+            {
+                "command": "fetch_registered_contacts",
+                "phone_contacts": [
+                    {
+                        "phoneNumbers": [
+                            {"label": "mobile", "number": friend.phone_number}
+                        ]
+                    }
+                ],
+            }
+        )
+        event = await communicator.receive_json_from()
+        self.assertEqual(
+            event["registered_contacts"],
+            [{"phone_number": friend.phone_number, "display_name": "Friend"}],
+        )
+        self.assertEqual(
+            event["digest"],
+            update_contacts_digest(EMPTY_CONTACTS_DIGEST, [friend.phone_number]),
+        )
+        self.assertTrue(event["done"])
+        await communicator.disconnect()
@@ -0,0 +1,196 @@
+from unittest import mock
+
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.test import SimpleTestCase
+
+from blabhear.consumers import RoomConsumer, UserConsumer
+from blabhear.events import (
+    get_current_seq,
+    parse_seq,
+    replay_events,
+    room_stream,
+    send_room_event,
+    send_user_event,
+    user_stream,
+)
+from blabhear.models import Room
+from blabhear.tests.utils import ChannelLayerTestCase, create_user
+
+
+class ParseSeqTests(SimpleTestCase):
+    def test_parse_seq(self):
+        self.assertEqual(parse_seq("12"), 12)
+        self.assertEqual(parse_seq(0), 0)
+        self.assertIsNone(parse_seq(None))
+        self.assertIsNone(parse_seq("abc"))
+        self.assertIsNone(parse_seq("-1"))
+        self.assertIsNone(parse_seq([1]))
+
+
+class UserEventReplayTests(ChannelLayerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_user("Alice")
+
+    async def connect(self, query_string=""):
+        communicator = WebsocketCommunicator(
+            UserConsumer.as_asgi(), f"/ws/user/{self.user.username}/?{query_string}"
+        )
+        communicator.scope["url_route"] = {"kwargs": {"user_id": self.user.username}}
+        communicator.scope["user"] = self.user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def publish(self, *events):
+        for event in events:
+            await send_user_event(self.channel_layer, [self.user.username], event)
+        return await get_current_seq(
+            self.channel_layer, user_stream(self.user.username)
+        )
+
+    async def assert_full_fetch(self, communicator, seq):
+        display_name = await communicator.receive_json_from()
+        self.assertEqual(display_name["type"], "display_name")
+        self.assertEqual(display_name["seq"], seq)
+        notifications = await communicator.receive_json_from()
+        self.assertEqual(notifications["type"], "notifications")
+        self.assertEqual(notifications["seq"], seq)
+
+    async def test_resume_replays_missed_events(self):
+        last_seq = await self.publish({"type": "display_name", "display_name": "A"})
+        seq = await self.publish(
+            {"type": "display_name", "display_name": "B"},
+            {"type": "refresh_notifications", "room": None},
+        )
+        communicator = await self.connect(f"last_seq={last_seq}")
+        display_name = await communicator.receive_json_from()
+        self.assertEqual(display_name["display_name"], "B")
+        self.assertEqual(display_name["seq"], seq - 1)
+        notifications = await communicator.receive_json_from()
+        self.assertEqual(notifications["type"], "notifications")
+        self.assertEqual(notifications["seq"], seq)
+        await communicator.disconnect()
+
+    async def test_events_published_while_resuming_are_sent_once(self):
+        last_seq = await self.publish({"type": "display_name", "display_name": "A"})
+
+        async def replay_after_publish(channel_layer, stream, last_seq):
+            await self.publish({"type": "display_name", "display_name": "B"})
+            return await replay_events(channel_layer, stream, last_seq)
+
+        with mock.patch("blabhear.consumers.replay_events", replay_after_publish):
+            communicator = await self.connect(f"last_seq={last_seq}")
+        display_name = await communicator.receive_json_from()
+        self.assertEqual(display_name["display_name"], "B")
+        self.assertEqual(display_name["seq"], last_seq + 1)
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+    async def test_resume_without_missed_events_sends_nothing(self):
+        seq = await self.publish({"type": "display_name", "display_name": "A"})
+        communicator = await self.connect(f"last_seq={seq}")
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+    async def test_malformed_last_seq_falls_back_to_full_fetch(self):
+        seq = await self.publish({"type": "display_name", "display_name": "A"})
+        communicator = await self.connect("last_seq=abc")
+        await self.assert_full_fetch(communicator, seq)
+        await communicator.disconnect()
+
+    async def test_last_seq_ahead_of_stream_falls_back_to_full_fetch(self):
+        seq = await self.publish({"type": "display_name", "display_name": "A"})
+        communicator = await self.connect(f"last_seq={seq + 10}")
+        await self.assert_full_fetch(communicator, seq)
+        await communicator.disconnect()
+
+    async def test_replay_from_trimmed_stream_returns_none(self):
+        seq = await self.publish({"type": "display_name", "display_name": "A"})
+        stream = user_stream(self.user.username)
+        self.assertEqual(await replay_events(self.channel_layer, stream, seq), [])
+        async with self.channel_layer.connection(
+            self.channel_layer.consistent_hash(stream)
+        ) as connection:
+            await connection.xtrim(f"{self.channel_layer.prefix}:events:{stream}", 0)
+        self.assertIsNone(await replay_events(self.channel_layer, stream, seq - 1))
+
+
+class RoomEventReplayTests(ChannelLayerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_user("Alice")
+        self.friend = create_user("Bob")
+
+    async def connect(self, last_seq=None):
+        communicator = WebsocketCommunicator(RoomConsumer.as_asgi(), "/ws/room/")
+        communicator.scope["user"] = self.user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.send_json_to(
+            {
+                "command": "connect",
+                "phone_numbers": [self.friend.phone_number],
+                "last_seq": last_seq,
+            }
+        )
+        return communicator
+
+    async def test_resume_sends_upload_url_and_missed_events(self):
+        communicator = await self.connect()
+        new_room = await communicator.receive_json_from()
+        self.assertEqual(new_room["type"], "new_room")
+        self.assertEqual((await communicator.receive_json_from())["type"], "upload_url")
+        await communicator.receive_json_from()
+        await communicator.disconnect()
+        room_id = str(
+            await database_sync_to_async(Room.objects.get)(members=self.friend)
+        )
+        await send_room_event(
+            self.channel_layer,
+            room_id,
+            {"type": "updated_room_name", "room_name": "Renamed"},
+        )
+        communicator = await self.connect(new_room["seq"])
+        events = {}
+        for _ in range(2):
+            event = await communicator.receive_json_from()
+            events[event["type"]] = event
+        self.assertIn("upload_url", events)
+        updated_room_name = events["updated_room_name"]
+        self.assertEqual(updated_room_name["room_name"], "Renamed")
+        self.assertEqual(
+            updated_room_name["seq"],
+            await get_current_seq(self.channel_layer, room_stream(room_id)),
+        )
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+    async def test_events_published_while_resuming_are_sent_once(self):
+        communicator = await self.connect()
+        new_room = await communicator.receive_json_from()
+        for _ in range(2):
+            await communicator.receive_json_from()
+        await communicator.disconnect()
+        room_id = str(
+            await database_sync_to_async(Room.objects.get)(members=self.friend)
+        )
+
+        async def replay_after_publish(channel_layer, stream, last_seq):
+            await send_room_event(
+                channel_layer,
+                room_id,
+                {"type": "updated_room_name", "room_name": "Renamed"},
+            )
+            return await replay_events(channel_layer, stream, last_seq)
+
+        with mock.patch("blabhear.consumers.replay_events", replay_after_publish):
+            communicator = await self.connect(new_room["seq"])
+            events = [await communicator.receive_json_from() for _ in range(2)]
+        self.assertEqual(
+            sorted(event["type"] for event in events),
+            ["updated_room_name", "upload_url"],
+        )
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
@@ -0,0 +1,45 @@
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from blabhear.models import Message, MessageNotification
+from blabhear.tests.utils import create_room, create_user, room_consumer, send_message
+
+
+@override_settings(MESSAGE_HISTORY_PAGE_SIZE=2)
+class MessageHistoryTests(TestCase):
+    def setUp(self):
+        self.user = create_user("Alice")
+        self.friend = create_user("Bob")
+        self.room = create_room([self.user, self.friend])
+        self.consumer = room_consumer(self.user, self.room)
+
+    def read_history(self):
+        message_ids = []
+        cursor = None
+        while True:
+            notifications, cursor = self.consumer.get_message_history(cursor)
+            message_ids += [
+                notification["message__id"] for notification in notifications
+            ]
+            if cursor is None:
+                return message_ids
+
+    def test_pages_through_history_newest_first(self):
+        messages = [send_message(self.friend, self.room) for _ in range(5)]
+        self.assertEqual(
+            self.read_history(), [str(message.id) for message in reversed(messages)]
+        )
+
+    def test_messages_with_the_same_timestamp_are_not_skipped(self):
+        messages = [send_message(self.friend, self.room) for _ in range(5)]
+        now = timezone.now()
+        Message.objects.update(created_at=now)
+        MessageNotification.objects.update(timestamp=now)
+        message_ids = self.read_history()
+        self.assertEqual(len(message_ids), 5)
+        self.assertEqual(set(message_ids), {str(message.id) for message in messages})
+
+    def test_malformed_cursors_return_an_empty_page(self):
+        send_message(self.friend, self.room)
+        for cursor in ["garbage", "2023-01-01T00:00:00,not-a-uuid", ["a"], 5]:
+            self.assertEqual(self.consumer.get_message_history(cursor), ([], None))
@@ -0,0 +1,177 @@
+from io import StringIO
+
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+
+from blabhear.inbox import (
+    find_stale_inbox_entries,
+    find_stale_unread_totals,
+    rebuild_inbox,
+    rebuild_unread_totals,
+)
+from blabhear.models import User, UserRoomNotification
+from blabhear.tests.utils import (
+    create_room,
+    create_user,
+    room_consumer,
+    send_message,
+    user_consumer,
+)
+
+
+class InboxQueryTests(TestCase):
+    def setUp(self):
+        self.user = create_user("Owner")
+
+    def create_direct_rooms(self, count):
+        for number in range(count):
+            create_room([self.user, create_user(f"Friend {number}")])
+
+    def test_get_notifications_query_count_does_not_grow_with_rooms(self):
+        consumer = user_consumer(self.user)
+        self.create_direct_rooms(3)
+        with self.assertNumQueries(1):
+            notifications = consumer.get_notifications()
+        self.assertEqual(len(notifications), 3)
+        self.create_direct_rooms(3)
+        with self.assertNumQueries(1):
+            notifications = consumer.get_notifications()
+        self.assertEqual(len(notifications), 6)
+
+    def test_get_notifications_names_direct_rooms_after_the_counterpart(self):
+        friend = create_user("Friend")
+        create_room([self.user, friend])
+        notifications = user_consumer(self.user).get_notifications()
+        self.assertEqual(notifications[0]["room__display_name"], "Friend")
+        notifications = user_consumer(friend).get_notifications()
+        self.assertEqual(notifications[0]["room__display_name"], "Owner")
+
+
+class InboxFanOutTests(TestCase):
+    message_log = False
+
+    def setUp(self):
+        self.alice = create_user("Alice")
+        self.bob = create_user("Bob")
+        self.carol = create_user("Carol")
+        self.carol.blocked_users.add(self.alice)
+        self.room = create_room(
+            [self.alice, self.bob, self.carol], message_log=self.message_log
+        )
+
+    def get_inbox_row(self, user):
+        return user_consumer(user).get_notifications()[0]
+
+    def test_new_message_updates_recipient_inbox_rows(self):
+        send_message(self.alice, self.room)
+        send_message(self.alice, self.room)
+        row = self.get_inbox_row(self.bob)
+        self.assertFalse(row["read"])
+        self.assertFalse(row["is_own_message"])
+        self.assertEqual(row["message__creator__display_name"], "Alice")
+        self.assertEqual(row["unread_count"], 2)
+        self.assertEqual(row["version"], 2)
+        row = self.get_inbox_row(self.alice)
+        self.assertTrue(row["read"])
+        self.assertTrue(row["is_own_message"])
+        self.assertEqual(row["unread_count"], 0)
+
+    def test_messages_from_blocked_users_leave_the_inbox_untouched(self):
+        send_message(self.alice, self.room)
+        row = self.get_inbox_row(self.carol)
+        self.assertIsNone(row["message__creator__display_name"])
+        self.assertEqual(row["unread_count"], 0)
+        self.assertEqual(row["version"], 0)
+
+    def test_reading_the_room_clears_the_unread_state(self):
+        send_message(self.alice, self.room)
+        version = self.get_inbox_row(self.bob)["version"]
+        room_consumer(self.bob, self.room).read_unread_room_notification()
+        row = self.get_inbox_row(self.bob)
+        self.assertTrue(row["read"])
+        self.assertEqual(row["unread_count"], 0)
+        self.assertEqual(row["version"], version + 1)
+
+    def test_display_name_change_updates_the_last_message_preview(self):
+        send_message(self.alice, self.room)
+        version = self.get_inbox_row(self.bob)["version"]
+        user_consumer(self.alice).change_display_name("Alicia")
+        row = self.get_inbox_row(self.bob)
+        self.assertEqual(row["message__creator__display_name"], "Alicia")
+        self.assertEqual(row["version"], version + 1)
+
+
+class LogRoomInboxFanOutTests(InboxFanOutTests):
+    message_log = True
+
+
+class InboxCheckTests(TestCase):
+    message_log = False
+
+    def setUp(self):
+        self.alice = create_user("Alice")
+        self.bob = create_user("Bob")
+        self.carol = create_user("Carol")
+        self.room = create_room(
+            [self.alice, self.bob, self.carol], message_log=self.message_log
+        )
+        self.first = send_message(self.alice, self.room)
+        send_message(self.carol, self.room)
+        send_message(self.alice, self.room)
+
+    def get_stale_fields(self):
+        return {
+            (notification.user_id, field)
+            for notification, stale_fields in find_stale_inbox_entries()
+            for field in stale_fields
+        }
+
+    def test_live_updates_keep_the_inbox_consistent(self):
+        room_consumer(self.bob, self.room).delete_message_notification(
+            str(self.first.id)
+        )
+        room_consumer(self.carol, self.room).block_message_notification_user(
+            str(self.first.id)
+        )
+        room_consumer(self.alice, self.room).read_unread_room_notification()
+        self.assertEqual(self.get_stale_fields(), set())
+        self.assertEqual(list(find_stale_unread_totals()), [])
+        call_command("check_inbox", stdout=StringIO())
+
+    def test_rebuild_restores_unread_counts_and_totals(self):
+        UserRoomNotification.objects.filter(user=self.bob).update(
+            unread_count=7, read_seq=99
+        )
+        self.assertEqual(
+            self.get_stale_fields(),
+            {(self.bob.id, "unread_count"), (self.bob.id, "read_seq")},
+        )
+        self.assertEqual(rebuild_inbox(), 1)
+        self.room.refresh_from_db()
+        notification = UserRoomNotification.objects.get(user=self.bob)
+        self.assertEqual(notification.read_seq, self.room.message_seq)
+        self.assertEqual(notification.unread_count, 0)
+        self.assertEqual(User.objects.get(id=self.bob.id).unread_count, 0)
+
+    def test_rebuild_recounts_after_messages_disappear(self):
+        self.first.delete()
+        self.assertEqual(self.get_stale_fields(), {(self.bob.id, "unread_count")})
+        rebuild_inbox()
+        self.assertEqual(
+            UserRoomNotification.objects.get(user=self.bob).unread_count, 2
+        )
+        self.assertEqual(User.objects.get(id=self.bob.id).unread_count, 2)
+        self.assertEqual(list(find_stale_unread_totals()), [])
+
+    def test_check_and_rebuild_commands_cover_unread_totals(self):
+        User.objects.filter(id=self.bob.id).update(unread_count=10)
+        self.assertEqual(list(find_stale_unread_totals()), [(self.bob.id, 10, 3)])
+        with self.assertRaises(CommandError):
+            call_command("check_inbox", stdout=StringIO())
+        call_command("rebuild_inbox", stdout=StringIO())
+        self.assertEqual(User.objects.get(id=self.bob.id).unread_count, 3)
+        self.assertEqual(rebuild_unread_totals(), 0)
+
+
+class LogRoomInboxCheckTests(InboxCheckTests):
+    message_log = True
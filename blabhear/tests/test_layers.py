@@ -0,0 +1,60 @@
+import asyncio
+import uuid
+
+from blabhear.tests.utils import ChannelLayerTestCase
+
+
+class BulkRedisChannelLayerTests(ChannelLayerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.first_group, self.second_group, self.empty_group = (
+            uuid.uuid4().hex for _ in range(3)
+        )
+
+    async def receive(self, channel_name):
+        return await asyncio.wait_for(self.channel_layer.receive(channel_name), 1)
+
+    async def test_group_channels_many_lists_each_group(self):
+        first = await self.channel_layer.new_channel()
+        second = await self.channel_layer.new_channel()
+        await self.channel_layer.group_add(self.first_group, first)
+        await self.channel_layer.group_add(self.first_group, second)
+        await self.channel_layer.group_add(self.second_group, second)
+        group_channels = await self.channel_layer.group_channels_many(
+            [self.first_group, self.second_group, self.empty_group]
+        )
+        self.assertEqual(
+            sorted(group_channels[self.first_group]), sorted([first, second])
+        )
+        self.assertEqual(group_channels[self.second_group], [second])
+        self.assertEqual(group_channels[self.empty_group], [])
+
+    async def test_group_send_many_delivers_each_message_to_its_group(self):
+        first = await self.channel_layer.new_channel()
+        second = await self.channel_layer.new_channel()
+        await self.channel_layer.group_add(self.first_group, first)
+        await self.channel_layer.group_add(self.second_group, second)
+        await self.channel_layer.group_send_many(
+            [
+                (self.first_group, {"type": "ping", "group": self.first_group}),
+                (self.second_group, {"type": "ping", "group": self.second_group}),
+                (self.empty_group, {"type": "ping", "group": self.empty_group}),
+            ]
+        )
+        self.assertEqual((await self.receive(first))["group"], self.first_group)
+        self.assertEqual((await self.receive(second))["group"], self.second_group)
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(self.channel_layer.receive(first), 0.2)
+
+    async def test_group_send_many_reaches_channels_in_several_groups(self):
+        channel_name = await self.channel_layer.new_channel()
+        await self.channel_layer.group_add(self.first_group, channel_name)
+        await self.channel_layer.group_add(self.second_group, channel_name)
+        await self.channel_layer.group_send_many(
+            [
+                (self.first_group, {"type": "ping", "group": self.first_group}),
+                (self.second_group, {"type": "ping", "group": self.second_group}),
+            ]
+        )
+        received = {(await self.receive(channel_name))["group"] for _ in range(2)}
+        self.assertEqual(received, {self.first_group, self.second_group})
@@ -0,0 +1,126 @@
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from blabhear.models import HiddenMessage, Message, MessageNotification
+from blabhear.tests.utils import create_room, create_user, room_consumer, send_message
+
+
+class MessageStorageTests(TestCase):
+    message_log = False
+
+    def setUp(self):
+        self.alice = create_user("Alice")
+        self.bob = create_user("Bob")
+        self.carol = create_user("Carol")
+        self.room = create_room(
+            [self.alice, self.bob, self.carol], message_log=self.message_log
+        )
+
+    def get_visible_message_ids(self, user):
+        return [
+            str(notification["message__id"])
+            for notification in room_consumer(
+                user, self.room
+            ).get_room_message_notifications()
+        ]
+
+    def test_deleted_messages_are_hidden_only_for_that_member(self):
+        first = send_message(self.alice, self.room)
+        second = send_message(self.alice, self.room)
+        room_consumer(self.bob, self.room).delete_message_notification(str(first.id))
+        self.assertEqual(self.get_visible_message_ids(self.bob), [second.id])
+        self.assertEqual(
+            self.get_visible_message_ids(self.carol), [second.id, first.id]
+        )
+
+    def test_blocking_hides_earlier_and_later_messages_from_the_creator(self):
+        first = send_message(self.alice, self.room)
+        send_message(self.bob, self.room)
+        room_consumer(self.carol, self.room).block_message_notification_user(
+            str(first.id)
+        )
+        send_message(self.alice, self.room)
+        self.assertEqual(
+            self.get_visible_message_ids(self.carol),
+            [str(Message.objects.get(creator=self.bob).id)],
+        )
+
+    def test_reporting_accepts_a_message_id(self):
+        message = send_message(self.alice, self.room)
+        room_consumer(self.bob, self.room).report_message_notification(str(message.id))
+        self.assertTrue(self.bob.report_set.filter(message=message).exists())
+
+
+class LogRoomMessageStorageTests(MessageStorageTests):
+    message_log = True
+
+    def test_sending_does_not_write_message_notifications(self):
+        send_message(self.alice, self.room)
+        self.assertFalse(MessageNotification.objects.exists())
+
+    def test_backfilled_rooms_do_not_touch_message_notifications(self):
+        message = send_message(self.alice, self.room)
+        consumer = room_consumer(self.bob, self.room)
+        with CaptureQueriesContext(connection) as queries:
+            consumer.get_message_history(None)
+            consumer.report_message_notification(str(message.id))
+            consumer.delete_message_notification(str(message.id))
+        self.assertFalse(
+            any("blabhear_messagenotification" in query["sql"] for query in queries)
+        )
+
+
+class DualReadMessageStorageTests(TestCase):
+    def setUp(self):
+        self.alice = create_user("Alice")
+        self.bob = create_user("Bob")
+        self.carol = create_user("Carol")
+        self.room = create_room([self.alice, self.bob, self.carol], message_log=False)
+        self.legacy_message = send_message(self.alice, self.room)
+        Message.objects.update(seq=None)
+        MessageNotification.objects.filter(receiver=self.carol).delete()
+        self.room.message_log = True
+        self.room.save(update_fields=["message_log"])
+
+    def get_visible_message_ids(self, user):
+        return [
+            str(notification["message__id"])
+            for notification in room_consumer(
+                user, self.room
+            ).get_room_message_notifications()
+        ]
+
+    def test_reads_both_stores_until_the_room_is_backfilled(self):
+        message = send_message(self.alice, self.room)
+        self.assertEqual(
+            self.get_visible_message_ids(self.bob), [message.id, self.legacy_message.id]
+        )
+        self.assertEqual(self.get_visible_message_ids(self.carol), [message.id])
+
+    def test_deleting_a_legacy_message_updates_both_stores(self):
+        room_consumer(self.bob, self.room).delete_message_notification(
+            str(self.legacy_message.id)
+        )
+        self.assertFalse(
+            MessageNotification.objects.filter(
+                receiver=self.bob, message=self.legacy_message
+            ).exists()
+        )
+        self.assertTrue(
+            HiddenMessage.objects.filter(
+                user=self.bob, message=self.legacy_message
+            ).exists()
+        )
+        self.assertEqual(self.get_visible_message_ids(self.bob), [])
+
+
+class MessageLogThresholdTests(TestCase):
+    def test_rooms_above_the_threshold_use_the_message_log(self):
+        members = [create_user() for _ in range(3)]
+        with override_settings(MESSAGE_LOG_MEMBER_THRESHOLD=3):
+            self.assertFalse(create_room(members).message_log)
+        with override_settings(MESSAGE_LOG_MEMBER_THRESHOLD=2):
+            room = create_room(members[1:] + [create_user()] + members[:1])
+        self.assertTrue(room.message_log)
+        self.assertTrue(room.message_log_backfilled)
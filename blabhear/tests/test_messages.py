@@ -0,0 +1,99 @@
+import uuid
+
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+
+from blabhear.consumers import RoomConsumer
+from blabhear.models import Room
+from blabhear.tests.utils import ChannelLayerTestCase, create_user, room_consumer
+
+
+class RoomMessageEventTests(ChannelLayerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = create_user("Alice")
+        self.bob = create_user("Bob")
+        self.carol = create_user("Carol")
+        self.carol.blocked_users.add(self.alice)
+        self.members = [self.alice, self.bob, self.carol]
+
+    async def connect(self, user, last_seq=None):
+        communicator = WebsocketCommunicator(RoomConsumer.as_asgi(), "/ws/room/")
+        communicator.scope["user"] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.send_json_to(
+            {
+                "command": "connect",
+                "phone_numbers": [
+                    member.phone_number for member in self.members if member != user
+                ],
+                "last_seq": last_seq,
+            }
+        )
+        return communicator
+
+    async def receive(self, communicator, count):
+        events = {}
+        for _ in range(count):
+            event = await communicator.receive_json_from()
+            events.setdefault(event["type"], []).append(event)
+        return events
+
+    async def send_message(self, communicator):
+        filename = str(uuid.uuid4())
+        await communicator.send_json_to(
+            {"command": "send_message", "filename": filename}
+        )
+        return filename
+
+    async def test_new_message_is_shared_and_personalized_on_delivery(self):
+        communicators = {}
+        for user in self.members:
+            communicators[user] = await self.connect(user)
+            await self.receive(communicators[user], 3)
+        filename = await self.send_message(communicators[self.alice])
+        events = await self.receive(communicators[self.alice], 2)
+        self.assertEqual(events["new_message"][0]["message_id"], filename)
+        self.assertTrue(events["new_message"][0]["message"]["is_own_message"])
+        self.assertIn("upload_url", events)
+        new_message = (await self.receive(communicators[self.bob], 1))["new_message"][0]
+        self.assertEqual(new_message["message"]["message__id"], filename)
+        self.assertEqual(
+            new_message["message"]["message__creator__display_name"], "Alice"
+        )
+        self.assertFalse(new_message["message"]["is_own_message"])
+        self.assertTrue(new_message["message"]["url"].startswith("https://"))
+        self.assertTrue(await communicators[self.carol].receive_nothing())
+        for communicator in communicators.values():
+            await communicator.disconnect()
+
+    async def test_replay_skips_hidden_messages_and_signs_fresh_urls(self):
+        alice = await self.connect(self.alice)
+        new_room = (await self.receive(alice, 3))["new_room"][0]
+        hidden_filename = await self.send_message(alice)
+        await self.receive(alice, 2)
+        visible_filename = await self.send_message(alice)
+        await self.receive(alice, 2)
+        await alice.disconnect()
+        room = await database_sync_to_async(Room.objects.get)(members=self.carol)
+        await database_sync_to_async(
+            room_consumer(self.bob, room).delete_message_notification
+        )(hidden_filename)
+
+        bob = await self.connect(self.bob, new_room["seq"])
+        events = await self.receive(bob, 2)
+        self.assertIn("upload_url", events)
+        self.assertEqual(len(events["new_message"]), 1)
+        new_message = events["new_message"][0]
+        self.assertEqual(new_message["message_id"], visible_filename)
+        self.assertEqual(new_message["seq"], new_room["seq"] + 2)
+        self.assertFalse(new_message["message"]["is_own_message"])
+        self.assertTrue(new_message["message"]["url"].startswith("https://"))
+        self.assertTrue(await bob.receive_nothing())
+        await bob.disconnect()
+
+        carol = await self.connect(self.carol, new_room["seq"])
+        self.assertEqual(list(await self.receive(carol, 1)), ["upload_url"])
+        self.assertTrue(await carol.receive_nothing())
+        await carol.disconnect()
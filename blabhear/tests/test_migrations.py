@@ -0,0 +1,200 @@
+import importlib
+import uuid
+from unittest import mock
+
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TransactionTestCase
+
+from blabhear.inbox import find_stale_inbox_entries, find_stale_unread_totals
+from blabhear.models import Room, User, UserRoomNotification
+from blabhear.tests.utils import room_consumer
+
+convert_rooms_to_message_log = importlib.import_module(
+    "blabhear.migrations.0028_convert_rooms_to_message_log"
+)
+
+
+class MigrationTestCase(TransactionTestCase):
+    def setUp(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.migrate_from)
+        self.apps = executor.loader.project_state(self.migrate_from).apps
+
+    def tearDown(self):
+        self.migrate(None)
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets or executor.loader.graph.leaf_nodes())
+        return executor.loader.project_state(targets).apps if targets else None
+
+    def create_users(self, *names):
+        HistoricalUser = self.apps.get_model("blabhear", "User")
+        return [
+            HistoricalUser.objects.create(
+                username=uuid.uuid4().hex,
+                phone_number=f"+1650555900{number}",
+                alpha2_country_code="US",
+                display_name=name,
+            )
+            for number, name in enumerate(names)
+        ]
+
+    def create_room(self, members):
+        room = self.apps.get_model("blabhear", "Room").objects.create()
+        room.members.add(*members)
+        return room
+
+    def send(self, room, creator, receivers):
+        message = self.apps.get_model("blabhear", "Message").objects.create(
+            room=room, creator=creator
+        )
+        MessageNotification = self.apps.get_model("blabhear", "MessageNotification")
+        MessageNotification.objects.bulk_create(
+            [
+                MessageNotification(room=room, receiver=receiver, message=message)
+                for receiver in receivers
+            ]
+        )
+        return message
+
+
+class ConvertRoomsToMessageLogTests(MigrationTestCase):
+    migrate_from = [("blabhear", "0027_hidden_message")]
+    migrate_to = [("blabhear", "0028_convert_rooms_to_message_log")]
+
+    def test_large_rooms_keep_deletions_and_blocks_as_hidden_messages(self):
+        alice, bob, carol = self.create_users("Alice", "Bob", "Carol")
+        group = self.create_room([alice, bob, carol])
+        direct = self.create_room([alice, bob])
+        from_alice = self.send(group, alice, [alice, bob])
+        from_bob = self.send(group, bob, [alice, carol])
+        self.send(direct, alice, [alice, bob])
+
+        with mock.patch.object(
+            convert_rooms_to_message_log, "BATCH_SIZE", 1
+        ), mock.patch.object(
+            convert_rooms_to_message_log, "MESSAGE_LOG_MEMBER_THRESHOLD", 2
+        ):
+            apps = self.migrate(self.migrate_to)
+
+        HistoricalRoom = apps.get_model("blabhear", "Room")
+        self.assertTrue(HistoricalRoom.objects.get(id=group.id).message_log)
+        self.assertTrue(HistoricalRoom.objects.get(id=group.id).message_log_backfilled)
+        self.assertFalse(HistoricalRoom.objects.get(id=direct.id).message_log)
+        self.assertEqual(
+            set(
+                apps.get_model("blabhear", "HiddenMessage").objects.values_list(
+                    "user", "message"
+                )
+            ),
+            {(carol.id, from_alice.id), (bob.id, from_bob.id)},
+        )
+        HistoricalMessage = apps.get_model("blabhear", "Message")
+        self.assertEqual(
+            list(
+                HistoricalMessage.objects.filter(room=group.id)
+                .order_by("created_at")
+                .values_list("id", "seq")
+            ),
+            [(from_alice.id, 1), (from_bob.id, 2)],
+        )
+        self.assertEqual(HistoricalRoom.objects.get(id=group.id).message_seq, 2)
+        self.assertEqual(HistoricalRoom.objects.get(id=direct.id).message_seq, 1)
+        MessageNotification = apps.get_model("blabhear", "MessageNotification")
+        self.assertFalse(MessageNotification.objects.filter(room=group.id).exists())
+        self.assertEqual(MessageNotification.objects.filter(room=direct.id).count(), 2)
+
+        self.migrate(None)
+        visible_messages = {
+            user.display_name: [
+                str(notification["message__id"])
+                for notification in room_consumer(
+                    user, Room.objects.get(id=group.id)
+                ).get_room_message_notifications()
+            ]
+            for user in User.objects.all()
+        }
+        self.assertEqual(
+            visible_messages,
+            {
+                "Alice": [str(from_bob.id), str(from_alice.id)],
+                "Bob": [str(from_alice.id)],
+                "Carol": [str(from_bob.id)],
+            },
+        )
+
+
+class PopulateUnreadCountsTests(MigrationTestCase):
+    migrate_from = [("blabhear", "0019_user_fcm_registration_token")]
+    message_log_member_threshold = 50
+
+    def send(self, room, creator, receivers):
+        message = super().send(room, creator, receivers)
+        self.apps.get_model("blabhear", "UserRoomNotification").objects.filter(
+            room=room, user__in=receivers
+        ).update(message=message, read=False)
+        self.apps.get_model("blabhear", "UserRoomNotification").objects.filter(
+            room=room, user=creator
+        ).update(read=True)
+        return message
+
+    def create_room(self, members):
+        room = super().create_room(members)
+        UserRoomNotification = self.apps.get_model("blabhear", "UserRoomNotification")
+        UserRoomNotification.objects.bulk_create(
+            [UserRoomNotification(user=member, room=room) for member in members]
+        )
+        return room
+
+    def test_legacy_unread_rooms_get_read_seqs_and_unread_counts(self):
+        alice, bob, carol, dave = self.create_users("Alice", "Bob", "Carol", "Dave")
+        carol.blocked_users.add(alice)
+        group = self.create_room([alice, bob, carol, dave])
+        direct = self.create_room([alice, bob])
+        self.send(group, bob, [alice, bob, carol, dave])
+        hidden = self.send(group, alice, [alice, bob, dave])
+        self.send(group, alice, [alice, bob, dave])
+        self.send(direct, alice, [alice, bob])
+        self.apps.get_model("blabhear", "MessageNotification").objects.filter(
+            receiver=dave, message=hidden
+        ).delete()
+
+        with mock.patch.object(
+            convert_rooms_to_message_log,
+            "MESSAGE_LOG_MEMBER_THRESHOLD",
+            self.message_log_member_threshold,
+        ):
+            self.migrate(None)
+
+        self.assertEqual(Room.objects.get(id=group.id).message_seq, 3)
+        inbox = {
+            (notification.user.display_name, notification.room_id): (
+                notification.read_seq,
+                notification.unread_count,
+            )
+            for notification in UserRoomNotification.objects.select_related("user")
+        }
+        self.assertEqual(
+            inbox,
+            {
+                ("Alice", group.id): (3, 0),
+                ("Bob", group.id): (1, 2),
+                ("Carol", group.id): (0, 1),
+                ("Dave", group.id): (0, 2),
+                ("Alice", direct.id): (1, 0),
+                ("Bob", direct.id): (0, 1),
+            },
+        )
+        self.assertEqual(
+            dict(User.objects.values_list("display_name", "unread_count")),
+            {"Alice": 0, "Bob": 3, "Carol": 1, "Dave": 2},
+        )
+        self.assertEqual(list(find_stale_inbox_entries()), [])
+        self.assertEqual(list(find_stale_unread_totals()), [])
+
+
+class LogRoomPopulateUnreadCountsTests(PopulateUnreadCountsTests):
+    message_log_member_threshold = 2
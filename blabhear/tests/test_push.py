@@ -0,0 +1,146 @@
+import asyncio
+from types import SimpleNamespace
+from unittest import mock
+
+from channels.db import database_sync_to_async
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from firebase_admin import exceptions, messaging
+
+from blabhear.models import User
+from blabhear.push import MAX_MULTICAST_TOKENS, PushDispatcher
+from blabhear.tests.utils import create_user
+
+
+class FakeMulticast:
+    def __init__(self, failures=None, errors=None):
+        self.failures = failures or {}
+        self.errors = list(errors or [])
+        self.messages = []
+
+    def __call__(self, message):
+        self.messages.append(message)
+        if self.errors:
+            raise self.errors.pop(0)
+        return SimpleNamespace(
+            responses=[
+                SimpleNamespace(
+                    success=token not in self.failures,
+                    exception=self.failures.pop(token, None),
+                )
+                for token in message.tokens
+            ]
+        )
+
+
+@override_settings(PUSH_NOTIFICATION_MAX_ATTEMPTS=3, PUSH_NOTIFICATION_RETRY_BACKOFF=1)
+class PushDispatcherTests(TransactionTestCase):
+    def setUp(self):
+        sleep = mock.patch("blabhear.push.asyncio.sleep", new=mock.AsyncMock())
+        self.sleep = sleep.start()
+        self.addCleanup(sleep.stop)
+
+    async def test_deliver_sends_at_most_500_tokens_per_batch(self):
+        send_multicast = FakeMulticast()
+        tokens = [f"token-{number}" for number in range(MAX_MULTICAST_TOKENS * 2 + 1)]
+        await PushDispatcher(send_multicast).deliver(tokens, "Title", None, 1, "room")
+        self.assertEqual(
+            [len(message.tokens) for message in send_multicast.messages],
+            [MAX_MULTICAST_TOKENS, MAX_MULTICAST_TOKENS, 1],
+        )
+
+    async def test_send_batch_retries_transient_errors_with_backoff(self):
+        send_multicast = FakeMulticast(
+            failures={"token-1": exceptions.UnavailableError("unavailable")},
+            errors=[exceptions.DeadlineExceededError("deadline")],
+        )
+        with self.assertLogs("blabhear.push", "WARNING"):
+            await PushDispatcher(send_multicast).send_batch(
+                ["token-1", "token-2"], "Title", None, 1, "room"
+            )
+        self.assertEqual(
+            [message.tokens for message in send_multicast.messages],
+            [["token-1", "token-2"], ["token-1", "token-2"], ["token-1"]],
+        )
+        self.assertEqual([call.args[0] for call in self.sleep.await_args_list], [1, 2])
+
+    async def test_send_batch_gives_up_after_max_attempts(self):
+        send_multicast = FakeMulticast(
+            errors=[exceptions.UnavailableError("unavailable")] * 5
+        )
+        with self.assertLogs("blabhear.push", "WARNING") as logs:
+            await PushDispatcher(send_multicast).send_batch(
+                ["token-1"], "Title", None, 1, "room"
+            )
+        self.assertEqual(len(send_multicast.messages), 3)
+        self.assertIn("Gave up on push notification to 1 devices", logs.output[-1])
+
+    def test_enqueue_drops_missing_tokens(self):
+        dispatcher = PushDispatcher(FakeMulticast())
+        dispatcher.enqueue("room", None, "Alice", {None: 1, "": 2})
+        self.assertEqual(dispatcher.pending, {})
+        self.assertIsNone(dispatcher.queue)
+
+    async def test_deliver_clears_unregistered_tokens(self):
+        user = await self.create_user_with_token("token-1")
+        other_user = await self.create_user_with_token("token-2")
+        send_multicast = FakeMulticast(
+            failures={"token-1": messaging.UnregisteredError("unregistered")}
+        )
+        await PushDispatcher(send_multicast).deliver(
+            ["token-1", "token-2"], "Title", None, 1, "room"
+        )
+        self.assertIsNone(await self.get_registration_token(user))
+        self.assertEqual(await self.get_registration_token(other_user), "token-2")
+
+    @database_sync_to_async
+    def create_user_with_token(self, registration_token):
+        user = create_user()
+        user.fcm_registration_token = registration_token
+        user.save()
+        return user
+
+    @database_sync_to_async
+    def get_registration_token(self, user):
+        return User.objects.values_list("fcm_registration_token", flat=True).get(
+            id=user.id
+        )
+
+
+@override_settings(PUSH_NOTIFICATION_COALESCE_WINDOW=0.05)
+class PushCoalescingTests(SimpleTestCase):
+    def setUp(self):
+        self.send_multicast = FakeMulticast()
+        self.dispatcher = PushDispatcher(self.send_multicast)
+
+    async def settle(self, delay=0):
+        await asyncio.sleep(delay)
+        await self.dispatcher.queue.join()
+
+    async def stop(self):
+        for worker in self.dispatcher.workers:
+            worker.cancel()
+
+    async def test_first_message_is_pushed_immediately(self):
+        self.dispatcher.enqueue("room", None, "Alice", {"token-1": 1})
+        await self.settle()
+        self.assertEqual(len(self.send_multicast.messages), 1)
+        self.assertEqual(
+            self.send_multicast.messages[0].notification.title, "Alice spoke"
+        )
+        await self.stop()
+
+    async def test_follow_ups_within_the_window_are_coalesced(self):
+        self.dispatcher.enqueue("room", "Group", "Alice", {"token-1": 1})
+        self.dispatcher.enqueue("room", "Group", "Bob", {"token-1": 2})
+        self.dispatcher.enqueue("room", "Group", "Alice", {"token-1": 3})
+        await self.settle()
+        self.assertEqual(len(self.send_multicast.messages), 1)
+        await self.settle(0.1)
+        self.assertEqual(len(self.send_multicast.messages), 2)
+        follow_up = self.send_multicast.messages[1]
+        self.assertEqual(follow_up.notification.body, "Bob and Alice spoke 2 times")
+        self.assertEqual(follow_up.apns.payload.aps.badge, 3)
+        await self.settle(0.1)
+        self.assertEqual(len(self.send_multicast.messages), 2)
+        self.assertEqual(self.dispatcher.pending, {})
+        await self.stop()
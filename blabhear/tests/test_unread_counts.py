@@ -0,0 +1,141 @@
+import uuid
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from blabhear.models import User, UserRoomNotification
+from blabhear.tests.utils import (
+    create_room,
+    create_user,
+    room_consumer,
+    send_message,
+    user_consumer,
+)
+
+
+class UnreadCountTests(TestCase):
+    message_log = False
+
+    def setUp(self):
+        self.alice = create_user("Alice")
+        self.bob = create_user("Bob")
+        self.carol = create_user("Carol")
+        self.room = create_room(
+            [self.alice, self.bob, self.carol], message_log=self.message_log
+        )
+
+    def get_total_unread_count(self, user):
+        return User.objects.get(id=user.id).unread_count
+
+    def get_room_unread_count(self, user, room=None):
+        return UserRoomNotification.objects.get(
+            user=user, room=room or self.room
+        ).unread_count
+
+    def test_sending_counts_for_recipients_but_not_the_sender(self):
+        send_message(self.alice, self.room)
+        send_message(self.alice, self.room)
+        self.assertEqual(self.get_total_unread_count(self.bob), 2)
+        self.assertEqual(self.get_total_unread_count(self.alice), 0)
+
+    def test_total_spans_rooms(self):
+        direct_room = create_room([self.alice, self.bob])
+        send_message(self.alice, self.room)
+        send_message(self.alice, direct_room)
+        self.assertEqual(self.get_total_unread_count(self.bob), 2)
+        self.assertEqual(user_consumer(self.bob).get_total_unread_count(), 2)
+
+    def test_blocked_senders_are_not_counted(self):
+        self.carol.blocked_users.add(self.alice)
+        send_message(self.alice, self.room)
+        self.assertEqual(self.get_total_unread_count(self.carol), 0)
+        self.assertEqual(self.get_room_unread_count(self.carol), 0)
+
+    def test_reading_clears_the_room_from_the_total(self):
+        other_room = create_room([self.alice, self.bob])
+        send_message(self.alice, self.room)
+        send_message(self.alice, other_room)
+        room_consumer(self.bob, self.room).read_unread_room_notification()
+        self.assertEqual(self.get_room_unread_count(self.bob), 0)
+        self.assertEqual(self.get_total_unread_count(self.bob), 1)
+
+    def test_reading_locks_the_room_before_taking_its_seq(self):
+        send_message(self.alice, self.room)
+        with CaptureQueriesContext(connection) as queries:
+            room_consumer(self.bob, self.room).read_unread_room_notification()
+        self.assertIn("FOR UPDATE", queries[1]["sql"])
+        self.assertIn('"blabhear_room"', queries[1]["sql"].split("WHERE")[0])
+        notification = UserRoomNotification.objects.get(user=self.bob)
+        self.assertEqual(notification.read_seq, 1)
+        self.assertEqual(self.get_total_unread_count(self.bob), 0)
+
+    def test_replying_clears_the_senders_unread_messages(self):
+        send_message(self.alice, self.room)
+        send_message(self.bob, self.room)
+        self.assertEqual(self.get_total_unread_count(self.bob), 0)
+        self.assertEqual(self.get_total_unread_count(self.alice), 1)
+
+    def test_hiding_an_unread_message_decrements(self):
+        message = send_message(self.alice, self.room)
+        send_message(self.alice, self.room)
+        room_consumer(self.bob, self.room).delete_message_notification(str(message.id))
+        self.assertEqual(self.get_room_unread_count(self.bob), 1)
+        self.assertEqual(self.get_total_unread_count(self.bob), 1)
+
+    def test_hiding_a_read_message_does_not_decrement(self):
+        message = send_message(self.alice, self.room)
+        consumer = room_consumer(self.bob, self.room)
+        consumer.read_unread_room_notification()
+        send_message(self.alice, self.room)
+        consumer.delete_message_notification(str(message.id))
+        self.assertEqual(self.get_total_unread_count(self.bob), 1)
+
+    def test_blocking_forgets_unread_messages_from_the_creator(self):
+        message = send_message(self.alice, self.room)
+        send_message(self.alice, self.room)
+        send_message(self.carol, self.room)
+        room_consumer(self.bob, self.room).block_message_notification_user(
+            str(message.id)
+        )
+        self.assertEqual(self.get_room_unread_count(self.bob), 1)
+        self.assertEqual(self.get_total_unread_count(self.bob), 1)
+
+    def test_push_badge_uses_the_total(self):
+        User.objects.filter(id=self.bob.id).update(fcm_registration_token="token")
+        other_room = create_room([self.alice, self.bob])
+        send_message(self.alice, other_room)
+        consumer = room_consumer(self.alice, self.room)
+        message, created = consumer.get_message(str(uuid.uuid4()))
+        (
+            member_usernames,
+            push_recipients,
+            excluded_usernames,
+        ) = consumer.fan_out_new_message(message)
+        self.assertEqual(push_recipients[self.bob.username], ("token", 2))
+
+
+class LogRoomUnreadCountTests(UnreadCountTests):
+    message_log = True
+
+    def test_hiding_a_message_twice_decrements_once(self):
+        message = send_message(self.alice, self.room)
+        send_message(self.alice, self.room)
+        consumer = room_consumer(self.bob, self.room)
+        consumer.delete_message_notification(str(message.id))
+        consumer.delete_message_notification(str(message.id))
+        self.assertEqual(self.get_total_unread_count(self.bob), 1)
+
+
+class TakeUnreadCountTests(TestCase):
+    def test_taking_the_count_bumps_the_version(self):
+        alice = create_user("Alice")
+        bob = create_user("Bob")
+        room = create_room([alice, bob])
+        send_message(alice, room)
+        send_message(alice, room)
+        version = UserRoomNotification.objects.get(user=bob).version
+        self.assertEqual(room_consumer(bob, room).take_unread_count(), 2)
+        notification = UserRoomNotification.objects.get(user=bob)
+        self.assertEqual(notification.unread_count, 0)
+        self.assertEqual(notification.version, version + 1)
@@ -0,0 +1,61 @@
+import itertools
+import uuid
+
+from channels.layers import channel_layers, get_channel_layer
+from django.test import TransactionTestCase
+
+from blabhear.consumers import RoomConsumer, UserConsumer
+from blabhear.models import User
+from blabhear.rooms import get_member_key
+
+phone_numbers = (f"+1650555{number:04d}" for number in itertools.count())
+
+
+def create_user(display_name="User"):
+    phone_number = next(phone_numbers)
+    return User.objects.create(
+        username=uuid.uuid4().hex,
+        phone_number=phone_number,
+        alpha2_country_code="US",
+        display_name=display_name,
+    )
+
+
+def create_room(members, message_log=None):
+    consumer = RoomConsumer()
+    consumer.user = members[0]
+    room = consumer.create_room(
+        members, get_member_key(member.id for member in members)
+    )
+    if message_log is not None:
+        room.message_log = message_log
+        room.message_log_backfilled = message_log
+        room.save(update_fields=["message_log", "message_log_backfilled"])
+    return room
+
+
+def user_consumer(user):
+    consumer = UserConsumer()
+    consumer.user = user
+    consumer.username = user.username
+    return consumer
+
+
+def room_consumer(user, room):
+    consumer = RoomConsumer()
+    consumer.user = user
+    consumer.room_id = str(room.id)
+    return consumer
+
+
+class ChannelLayerTestCase(TransactionTestCase):
+    def setUp(self):
+        channel_layers.backends.clear()
+        self.channel_layer = get_channel_layer()
+
+
+def send_message(user, room):
+    consumer = room_consumer(user, room)
+    message, created = consumer.get_message(str(uuid.uuid4()))
+    consumer.fan_out_new_message(message)
+    return message
@@ -4,4 +4,5 @@ from blabhear import views
 
 urlpatterns = [
     path(r"account", views.DeleteAccountView.as_view()),
+    path(r"metrics", views.MetricsView.as_view()),
 ]
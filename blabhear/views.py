@@ -1,10 +1,17 @@
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
 from django.db.models import Count
 from firebase_admin.auth import delete_user
 from rest_framework import status
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from blabhear.models import User, Room
+from blabhear.inbox import discard_unread_counts, rebuild_inbox
+from blabhear.metrics import metrics
+from blabhear.models import User, Room, UserRoomNotification
+from blabhear.rooms import refresh_member_keys
 
 
 class DeleteAccountView(APIView):
@@ -13,8 +20,30 @@ class DeleteAccountView(APIView):
             delete_user(request.user.username)
         except Exception:
             pass
+        room_ids = list(
+            Room.objects.filter(members__username=request.user.username).values_list(
+                "id", flat=True
+            )
+        )
         User.objects.filter(username=request.user.username).delete()
-        Room.objects.annotate(num_members=Count("members")).filter(
-            num_members=1
-        ).delete()
+        with transaction.atomic():
+            empty_rooms = Room.objects.annotate(num_members=Count("members")).filter(
+                num_members=1
+            )
+            discard_unread_counts(
+                UserRoomNotification.objects.filter(room__in=empty_rooms.values("id"))
+            )
+            empty_rooms.delete()
+        refresh_member_keys(Room.objects.filter(id__in=room_ids))
+        rebuild_inbox(UserRoomNotification.objects.filter(room__in=room_ids))
+        async_to_sync(get_channel_layer().group_send_many)(
+            [(str(room_id), {"type": "membership_changed"}) for room_id in room_ids]
+        )
         return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class MetricsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(metrics.snapshot())
@@ -141,13 +141,69 @@ ASGI_APPLICATION = "server.asgi.application"
 
 CHANNEL_LAYERS = {
     "default": {
-        "BACKEND": "channels_redis.core.RedisChannelLayer",
+        "BACKEND": "blabhear.layers.BulkRedisChannelLayer",
         "CONFIG": {
             "hosts": [os.environ.get("REDIS_URL")],
         },
     },
 }
 
+CACHES = {
+    "default": {
+        "BACKEND": "django_redis.cache.RedisCache",
+        "LOCATION": os.environ.get("REDIS_URL"),
+    },
+}
+
+ID_TOKEN_CACHE_SIZE = int(os.environ.get("ID_TOKEN_CACHE_SIZE", 10000))
+
+SIGNED_URL_CACHE_SIZE = int(os.environ.get("SIGNED_URL_CACHE_SIZE", 10000))
+SIGNED_URL_REUSE_MARGIN = float(os.environ.get("SIGNED_URL_REUSE_MARGIN", 86400))
+SIGNED_URL_SHARED_CACHE = bool(
+    os.environ.get("SIGNED_URL_SHARED_CACHE", "True") == "True"
+)
+URL_SIGNING_EXECUTOR = os.environ.get("URL_SIGNING_EXECUTOR", "thread")
+URL_SIGNING_WORKERS = int(os.environ.get("URL_SIGNING_WORKERS", 4))
+UPLOAD_URL_POOL_MIN_SIZE = int(os.environ.get("UPLOAD_URL_POOL_MIN_SIZE", 10))
+UPLOAD_URL_POOL_MAX_SIZE = int(os.environ.get("UPLOAD_URL_POOL_MAX_SIZE", 1000))
+UPLOAD_URL_POOL_RATE_WINDOW = float(os.environ.get("UPLOAD_URL_POOL_RATE_WINDOW", 60))
+UPLOAD_URL_POOL_HORIZON = float(os.environ.get("UPLOAD_URL_POOL_HORIZON", 120))
+
+PUSH_NOTIFICATION_WORKERS = int(os.environ.get("PUSH_NOTIFICATION_WORKERS", 4))
+PUSH_NOTIFICATION_MAX_ATTEMPTS = int(
+    os.environ.get("PUSH_NOTIFICATION_MAX_ATTEMPTS", 5)
+)
+PUSH_NOTIFICATION_RETRY_BACKOFF = float(
+    os.environ.get("PUSH_NOTIFICATION_RETRY_BACKOFF", 0.5)
+)
+PUSH_NOTIFICATION_COALESCE_WINDOW = float(
+    os.environ.get("PUSH_NOTIFICATION_COALESCE_WINDOW", 3)
+)
+
+CONTACT_NORMALIZATION_EXECUTOR = os.environ.get(
+    "CONTACT_NORMALIZATION_EXECUTOR", "thread"
+)
+CONTACT_NORMALIZATION_WORKERS = int(os.environ.get("CONTACT_NORMALIZATION_WORKERS", 2))
+CONTACT_NORMALIZATION_CHUNK_SIZE = int(
+    os.environ.get("CONTACT_NORMALIZATION_CHUNK_SIZE", 250)
+)
+CONTACT_NORMALIZATION_CACHE_SIZE = int(
+    os.environ.get("CONTACT_NORMALIZATION_CACHE_SIZE", 100000)
+)
+
+MESSAGE_LOG_MEMBER_THRESHOLD = int(os.environ.get("MESSAGE_LOG_MEMBER_THRESHOLD", 50))
+MESSAGE_HISTORY_PAGE_SIZE = int(os.environ.get("MESSAGE_HISTORY_PAGE_SIZE", 50))
+
+NOTIFICATIONS_REFRESH_DEBOUNCE = float(
+    os.environ.get("NOTIFICATIONS_REFRESH_DEBOUNCE", 0.25)
+)
+
+EVENT_STREAM_LENGTH = int(os.environ.get("EVENT_STREAM_LENGTH", 1000))
+EVENT_STREAM_TTL = int(os.environ.get("EVENT_STREAM_TTL", 604800))
+
+PRESENCE_HEARTBEAT_INTERVAL = float(os.environ.get("PRESENCE_HEARTBEAT_INTERVAL", 20))
+PRESENCE_TTL = float(os.environ.get("PRESENCE_TTL", 60))
+
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
         "blabhear.authentication.FirebaseAuthentication",